@@ -1,7 +1,49 @@
+import zlib
+
 
 def simple_checksum(data: bytes):
-    data = bytearray(data)
-    checksum = 0
-    for byte in data:
-        checksum ^= byte
+    """
+    Простая контрольная сумма - XOR всех байт данных.
+    Вместо цикла по байтам данные переводятся в целое число, которое сворачивается пополам,
+    пока не останется один байт: XOR старшей и младшей половин сохраняет XOR всех байт
+    :param data: байтовая строка или любой объект с буферным протоколом (bytearray, memoryview)
+    :return: значение контрольной суммы от 0 до 255
+    """
+    width = memoryview(data).nbytes
+    checksum = int.from_bytes(data, byteorder='little')
+    while width > 1:
+        half = width // 2
+        # Нечётный байт посередине остаётся в младшей части
+        width -= half
+        checksum = (checksum >> (width * 8)) ^ (checksum & ((1 << (width * 8)) - 1))
     return checksum
+
+
+def crc32_checksum(data: bytes):
+    """
+    Контрольная сумма CRC32
+    :param data: байтовая строка или любой объект с буферным протоколом
+    :return: значение контрольной суммы, 4 байта
+    """
+    return zlib.crc32(data)
+
+
+def adler32_checksum(data: bytes):
+    """
+    Контрольная сумма Adler-32
+    :param data: байтовая строка или любой объект с буферным протоколом
+    :return: значение контрольной суммы, 4 байта
+    """
+    return zlib.adler32(data)
+
+
+# Алгоритмы контрольной суммы, которые клиент может выбрать по имени
+algorithms = {
+    'xor': simple_checksum,
+    'crc32': crc32_checksum,
+    'adler32': adler32_checksum
+}
+
+# Алгоритмы, допустимые в текстовом режиме. Все 4 байта сумм crc32 и adler32 произвольны и могут образовать '\n'
+# или '. ', которые разделяют текстовые кадры, поэтому эти алгоритмы доступны только в двоичном режиме
+textAlgorithms = ('xor',)
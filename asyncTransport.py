@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import functools
+import serial
+from serial import PARITY_ODD
+from connection import Connection
+from photoAlbumServer import photoAlbumServer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSerialStream:
+    """
+    Адаптер последовательного порта pyserial к интерфейсу потоков asyncio (StreamReader/StreamWriter).
+    Блокирующие чтение и запись порта выполняются в пуле потоков цикла событий
+    """
+
+    def __init__(self, port):
+        """
+        :param port: открытый порт pyserial с timeout=None
+        """
+        self.port = port
+        self._pending = []
+
+    async def readline(self) -> bytes:
+        """
+        Чтение строки до символа '\\n' включительно
+        :return: байты строки, b'' - если порт закрыт
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.port.readline)
+
+    async def readexactly(self, count: int) -> bytes:
+        """
+        Чтение заданного количества байт
+        :param count: количество байт
+        :return: байты
+        """
+        data = await asyncio.get_running_loop().run_in_executor(None, self.port.read, count)
+        if len(data) < count:
+            raise asyncio.IncompleteReadError(data, count)
+        return data
+
+    def write(self, data: bytes):
+        """
+        Постановка данных в очередь на запись. Данные записываются в порт при вызове drain
+        :param data: байты
+        """
+        self._pending.append(data)
+
+    async def drain(self):
+        """
+        Запись накопленных данных в порт. Возвращает управление, когда порт принял данные
+        """
+        data, self._pending = b''.join(self._pending), []
+        if data:
+            await asyncio.get_running_loop().run_in_executor(None, self.port.write, data)
+
+    def close(self):
+        """
+        Закрытие порта
+        """
+        self.port.close()
+
+    async def wait_closed(self):
+        """
+        Ожидание закрытия порта, порт закрывается сразу
+        """
+
+
+class AsyncTransport:
+    """
+    Транспорт сервера на asyncio: TCP-сервер и последовательные порты в одном цикле событий.
+    Команды выполняются тем же кодом photoAlbumServer, что и при работе через COM-порты,
+    в общем пуле потоков сервера
+    """
+
+    def __init__(self, server: photoAlbumServer):
+        """
+        :param server: экземпляр сервера, выполняющий команды
+        """
+        self.server = server
+        self.tcpServers = []
+
+    async def handleClient(self, reader, writer, name: str):
+        """
+        Обработка запросов одного клиента до отключения
+        :param reader: поток чтения - asyncio.StreamReader или AsyncSerialStream
+        :param writer: поток записи - asyncio.StreamWriter или AsyncSerialStream
+        :param name: название соединения, используется в сообщениях сервера
+        """
+        connection = Connection(writer, name, self.server.checkSum, self.server.retransmitBytes)
+        logger.info('Server > %s > Connected', name)
+        # Последняя задача обработки запроса: задачи выполняются по порядку, каждая ждёт предыдущую
+        previous = None
+        try:
+            while True:
+                process, sequence, waitResponse = await self._readRequest(connection, reader)
+                previous = asyncio.create_task(self._process(connection, writer, process, sequence, previous))
+                if waitResponse:
+                    await previous
+                else:
+                    previous.add_done_callback(functools.partial(photoAlbumServer.logFailure, connection))
+        except (asyncio.IncompleteReadError, ConnectionError, serial.SerialException):
+            pass
+        finally:
+            if previous is not None and not previous.done():
+                # Ответы на уже прочитанные запросы отправляются до закрытия соединения
+                await asyncio.gather(previous, return_exceptions=True)
+            logger.info('Server > %s > Disconnected', name)
+            writer.close()
+
+    async def _process(self, connection: Connection, writer, process, sequence: int = None, previous=None):
+        """
+        Обработка запроса в пуле потоков сервера и отправка ответа после ответа на предыдущий запрос
+        :param connection: соединение с клиентом
+        :param writer: поток записи
+        :param process: функция без аргументов, выполняющая запрос и возвращающая ответ
+        :param sequence: номер запроса или None
+        :param previous: задача обработки предыдущего запроса или None
+        """
+        if previous is not None:
+            # Ошибка предыдущего запроса уже записана в журнал, следующий запрос обрабатывается независимо от неё
+            await asyncio.wait([previous])
+        response = await asyncio.get_running_loop().run_in_executor(self.server.workers, self.server.executeRequest,
+                                                                    connection, process)
+        await self._send(connection, writer, response, sequence)
+        # Смена параметров передачи после отправки ответа на команду hello
+        self.server.applyPendingOptions(connection)
+
+    async def _readRequest(self, connection: Connection, reader) -> tuple:
+        """
+        Чтение одного запроса: разбор выполняет photoAlbumServer.requestParser, как и в транспорте на потоках
+        :param connection: соединение с клиентом
+        :param reader: поток чтения
+        :return: результат photoAlbumServer.requestParser
+        """
+        parser = self.server.requestParser(connection)
+        data = None
+        while True:
+            try:
+                size = parser.send(data)
+            except StopIteration as stop:
+                return stop.value
+            data = await (reader.readline() if size is None else reader.readexactly(size))
+
+    async def _send(self, connection: Connection, writer, response, sequence: int = None):
+        """
+        Отправка ответа с управлением потоком: следующий кадр готовится, только когда предыдущий принят сокетом,
+        поэтому большой файл не накапливается в буфере записи
+        :param connection: соединение с клиентом
+        :param writer: поток записи
+        :param response: кортеж или итератор из пар: код ответа, сообщение
+        :param sequence: номер запроса, которым помечаются кадры ответа, или None
+        """
+        loop = asyncio.get_running_loop()
+        frames = self.server.responseFrames(connection, response, sequence)
+        sentBytes = 0
+        with self.server.metrics.timer('send_seconds'):
+            if isinstance(response, tuple):
+                # Короткий ответ собирается целиком за один переход в пул потоков:
+                # контрольные суммы и сжатие большого списка каталога не блокируют цикл событий
+                frames = iter(await loop.run_in_executor(self.server.workers, list, frames))
+            while True:
+                # Чтение и кодирование части файла выполняется в пуле потоков, не блокируя цикл событий
+                if isinstance(response, tuple):
+                    frame = next(frames, None)
+                else:
+                    frame = await loop.run_in_executor(self.server.workers, next, frames, None)
+                if frame is None:
+                    break
+                writer.write(frame)
+                await writer.drain()
+                sentBytes += len(frame)
+        self.server.metrics.increment('bytes_sent_total', sentBytes)
+
+    async def serveTcp(self, host: str = '0.0.0.0', port: int = 7777) -> asyncio.AbstractServer:
+        """
+        Запуск TCP-сервера. Каждое подключение обслуживается как отдельный клиент со своей сессией
+        :param host: адрес для прослушивания
+        :param port: номер TCP-порта, 0 - выбрать свободный порт
+        :return: запущенный asyncio-сервер
+        """
+        async def onConnect(reader, writer):
+            peer = writer.get_extra_info('peername')
+            await self.handleClient(reader, writer, f'tcp://{peer[0]}:{peer[1]}')
+
+        tcpServer = await asyncio.start_server(onConnect, host, port)
+        self.tcpServers.append(tcpServer)
+        for listeningSocket in tcpServer.sockets:
+            logger.info('Server is running on %s', listeningSocket.getsockname())
+        return tcpServer
+
+    async def serveSerial(self, portName: str, baudrate: int = 9600):
+        """
+        Обслуживание клиента на последовательном порту до закрытия порта
+        :param portName: название COM-порта или адрес pyserial, например 'socket://localhost:7777'
+        :param baudrate: скорость передачи данных
+        """
+        if baudrate < 100:
+            raise ValueError('Too small baudrate')
+        port = serial.serial_for_url(portName, baudrate=baudrate, parity=PARITY_ODD, timeout=None)
+        logger.info('Server is running on port %s', portName)
+        stream = AsyncSerialStream(port)
+        await self.handleClient(stream, stream, portName)
+
+    async def serve(self, host: str = '0.0.0.0', tcpPort: int = 7777, serialPorts: list = (),
+                    baudrate: int = 9600):
+        """
+        Запуск TCP-сервера и обслуживание последовательных портов до отмены задачи
+        :param host: адрес для прослушивания TCP
+        :param tcpPort: номер TCP-порта, None - не запускать TCP-сервер
+        :param serialPorts: список названий последовательных портов
+        :param baudrate: скорость передачи данных последовательных портов
+        """
+        tasks = [asyncio.create_task(self.serveSerial(portName, baudrate)) for portName in serialPorts]
+        if tcpPort is not None:
+            tcpServer = await self.serveTcp(host, tcpPort)
+            tasks.append(asyncio.create_task(tcpServer.serve_forever()))
+        await asyncio.gather(*tasks)
+
+    def close(self):
+        """
+        Остановка TCP-серверов
+        """
+        for tcpServer in self.tcpServers:
+            tcpServer.close()
+        self.tcpServers = []
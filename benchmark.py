@@ -0,0 +1,443 @@
+"""
+Нагрузочные тесты сервера без COM-портов. Сервер подключается к сокету бенчмарка по адресу pyserial 'socket://',
+клиент работает в том же процессе. Скорость последовательной линии можно имитировать параметром --baudrate.
+
+Пример:
+    python benchmark.py --workloads ls get mixed checksum --baudrate 115200 --json results.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from photoAlbumServer import photoAlbumServer
+import CheckSum
+
+try:
+    import resource
+except ImportError:
+    # Модуль resource есть только в POSIX, в Windows пиковая память берётся из psutil, если он установлен
+    resource = None
+
+user, password = 'bench', 'bench'
+# Бит на байт при передаче по линии с контролем чётности: старт, 8 бит данных, чётность, стоп
+bitsPerByte = 11
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Перцентиль по ближайшему рангу
+    :param values: список значений
+    :param fraction: доля от 0 до 1
+    :return: значение перцентиля, 0 - если список пуст
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def peakRss():
+    """
+    Пиковый объём резидентной памяти процесса (сервер и клиент) с момента запуска
+    :return: объём в байтах или None, если его нельзя узнать на этой платформе
+    """
+    if resource is not None:
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # В Linux значение в килобайтах, в macOS - в байтах
+        return maxRss if sys.platform == 'darwin' else maxRss * 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    # peak_wset - пиковый рабочий набор процесса в Windows
+    return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+
+
+class LinkClient:
+    """
+    Клиент протокола сервера поверх сокета с имитацией скорости последовательной линии
+    """
+
+    def __init__(self, clientSocket: socket.socket, baudrate: int = None):
+        """
+        :param clientSocket: подключённый сокет
+        :param baudrate: скорость имитируемой линии в бит/сек. None - без ограничения
+        """
+        self.socket = clientSocket
+        self.stream = clientSocket.makefile('rb')
+        self.baudrate = baudrate
+        self.binaryMode = False
+        self.checkSum = CheckSum.simple_checksum
+        # Момент, раньше которого линия ещё занята переданными данными
+        self._lineFree = time.perf_counter()
+
+    def _throttle(self, count: int):
+        """
+        Задержка, соответствующая передаче заданного количества байт по линии
+        :param count: количество байт
+        """
+        if self.baudrate is None:
+            return
+        now = time.perf_counter()
+        self._lineFree = max(self._lineFree, now) + count * bitsPerByte / self.baudrate
+        if self._lineFree > now:
+            time.sleep(self._lineFree - now)
+
+    def _read(self, count: int) -> bytes:
+        data = self.stream.read(count)
+        if len(data) < count:
+            raise ConnectionError('Server closed connection')
+        self._throttle(count)
+        return data
+
+    def _readFrame(self) -> bytes:
+        """
+        Чтение одного кадра ответа
+        :return: тело кадра без контрольной суммы
+        """
+        if self.binaryMode:
+            length = int.from_bytes(self._read(4), byteorder='little')
+            body = self._read(length)
+            self._read(4)
+            return body
+        # Байт суммы xor может совпасть с '\\n', поэтому кадр заканчивается на '. ', 4 байта суммы и '\\n'
+        frame = b''
+        while len(frame) < 7 or frame[-7:-5] != b'. ':
+            line = self.stream.readline()
+            if not line:
+                raise ConnectionError('Server closed connection')
+            frame += line
+        self._throttle(len(frame))
+        return frame[:-5]
+
+    def send(self, command: str, corrupt: bool = False):
+        """
+        Отправка запроса
+        :param command: команда с аргументами
+        :param corrupt: True - испортить контрольную сумму запроса
+        """
+        body = (command + '. ').encode()
+        checkSum = self.checkSum(body) ^ (1 if corrupt else 0)
+        checkSum = checkSum.to_bytes(4, byteorder='little')
+        if self.binaryMode:
+            frame = len(body).to_bytes(4, byteorder='little') + body + checkSum
+        else:
+            frame = body + checkSum + b'\n'
+        self._throttle(len(frame))
+        self.socket.sendall(frame)
+
+    def receive(self) -> tuple:
+        """
+        Чтение полного ответа: заголовка и всех частей файла или списка каталога
+        :return: код первого ответа, количество принятых байт полезных данных
+        """
+        header = self._readFrame()
+        code = int(header[:3])
+        words = header.decode(errors='replace').split()
+        payload = 0
+        if code == 200 and 'follows' in words:
+            # Части файла: до получения заявленного количества байт
+            size = int(words[words.index('bytes') - 1])
+            while payload < size:
+                payload += len(self._readFrame()) - 6
+        elif code == 200 and 'items.' in words:
+            payload = len(self._readFrame()) - 6
+        return code, payload
+
+    def command(self, command: str, corrupt: bool = False) -> tuple:
+        """
+        Запрос и полный ответ
+        :param command: команда с аргументами
+        :param corrupt: True - испортить контрольную сумму запроса
+        :return: код первого ответа, количество байт полезных данных, время в секундах
+        """
+        start = time.perf_counter()
+        self.send(command, corrupt)
+        code, payload = self.receive()
+        return code, payload, time.perf_counter() - start
+
+    def hello(self, mode: str, checkSum: str):
+        """
+        Согласование режима передачи и алгоритма контрольной суммы
+        :param mode: 'text' или 'binary'
+        :param checkSum: название алгоритма из CheckSum.algorithms
+        """
+        code, _, _ = self.command(f'hello mode={mode} checksum={checkSum}')
+        if code != 200:
+            raise RuntimeError(f'hello failed with code {code}')
+        self.binaryMode = mode == 'binary'
+        self.checkSum = CheckSum.algorithms[checkSum]
+
+
+class Bench:
+    """
+    Сервер на синтетической фотобазе и подключённый к нему клиент
+    """
+
+    def __init__(self, root: str, args):
+        """
+        :param root: каталог синтетической фотобазы
+        :param args: параметры командной строки
+        """
+        self.root = root
+        self.args = args
+        usersFile = os.path.join(os.path.dirname(root), 'users.txt')
+        with open(usersFile, 'w') as users:
+            users.write(f'{user} {password}\n')
+        self.server = photoAlbumServer(inputPathToPhotoBase=root, chunkSize=args.chunk_size,
+                                       cacheSize=args.cache_size, usersFile=usersFile)
+
+        listener = socket.create_server(('127.0.0.1', 0))
+        url = f'socket://127.0.0.1:{listener.getsockname()[1]}'
+        self.thread = threading.Thread(target=self.server.start, args=(url,), daemon=True)
+        self.thread.start()
+        clientSocket, _ = listener.accept()
+        listener.close()
+        clientSocket.settimeout(args.timeout)
+        # pyserial очищает входной буфер после подключения, запрос отправляется после открытия порта сервером
+        while not self.server.connections:
+            time.sleep(0.01)
+        # В последовательной линии нет алгоритма Нейгла: без TCP_NODELAY несколько коротких кадров одного ответа
+        # ждут подтверждения клиента около 40 мс, и эта задержка TCP исказила бы задержки сервера
+        clientSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        serverSocket = getattr(self.server.connections[0].port, '_socket', None)
+        if serverSocket is not None:
+            serverSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.client = LinkClient(clientSocket, args.baudrate)
+        self.client.hello(args.mode, args.checksum)
+        code, _, _ = self.client.command(f'auth {user} {password}')
+        if code != 200:
+            raise RuntimeError(f'auth failed with code {code}')
+
+    def close(self):
+        self.server.close()
+        self.client.socket.close()
+        self.thread.join(5)
+
+
+def makePhoto(path: str, size: int):
+    """
+    Создание файла со случайным содержимым, похожего на сжатое фото
+    :param path: путь к файлу
+    :param size: размер в байтах
+    """
+    with open(path, 'wb') as photo:
+        left = size
+        while left > 0:
+            block = min(left, 1024 * 1024)
+            photo.write(os.urandom(block))
+            left -= block
+
+
+def result(name: str, latencies: list, payloadBytes: int, elapsed: float, **extra) -> dict:
+    """
+    Итог одного теста
+    :param name: название теста
+    :param latencies: время каждого запроса в секундах
+    :param payloadBytes: принято байт полезных данных
+    :param elapsed: общее время теста в секундах
+    :return: словарь с пропускной способностью, перцентилями задержки и пиковой памятью
+    """
+    rss = peakRss()
+    return {
+        'name': name,
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'requestsPerSecond': len(latencies) / elapsed if elapsed else 0.0,
+        'throughputMBps': payloadBytes / elapsed / 1024 / 1024 if elapsed else 0.0,
+        'p50ms': percentile(latencies, 0.5) * 1000,
+        'p90ms': percentile(latencies, 0.9) * 1000,
+        'p99ms': percentile(latencies, 0.99) * 1000,
+        'peakRssMB': None if rss is None else rss / 1024 / 1024,
+        **extra
+    }
+
+
+def runCommands(bench: Bench, name: str, commands: list, corruptRate: float = 0.0, **extra) -> dict:
+    """
+    Выполнение списка команд и замер времени
+    :param bench: сервер и клиент
+    :param name: название теста
+    :param commands: список команд
+    :param corruptRate: доля запросов с испорченной контрольной суммой. Такой запрос повторяется с верной суммой
+    :return: итог теста
+    """
+    latencies, payloadBytes, failures = [], 0, 0
+    start = time.perf_counter()
+    for command in commands:
+        if corruptRate and random.random() < corruptRate:
+            code, _, elapsed = bench.client.command(command, corrupt=True)
+            if code != 199:
+                raise RuntimeError(f'Expected 199 for corrupted "{command}", got {code}')
+            failures += 1
+            latencies.append(elapsed)
+        code, payload, elapsed = bench.client.command(command)
+        if code != 200:
+            raise RuntimeError(f'"{command}" failed with code {code}')
+        latencies.append(elapsed)
+        payloadBytes += payload
+    return result(name, latencies, payloadBytes, time.perf_counter() - start, injectedFailures=failures, **extra)
+
+
+def lsWorkload(bench: Bench) -> list:
+    """
+    Просмотр каталогов из большого количества файлов, целиком и постранично
+    """
+    results = []
+    for count in bench.args.ls_sizes:
+        directory = os.path.join(bench.root, f'ls{count}')
+        os.makedirs(directory, exist_ok=True)
+        for index in range(count):
+            open(os.path.join(directory, f'photo{index:06d}.jpg'), 'wb').close()
+        commands = [f'ls ls{count}'] * bench.args.repeat
+        results.append(runCommands(bench, f'ls {count} entries', commands))
+        commands = [f'ls ls{count} page={page} size=100' for page in range(1, bench.args.repeat + 1)]
+        results.append(runCommands(bench, f'ls {count} entries, page of 100', commands))
+    return results
+
+
+def getWorkload(bench: Bench) -> list:
+    """
+    Скачивание фото разного размера
+    """
+    results = []
+    for size in bench.args.get_sizes:
+        name = f'get{size}.jpg'
+        makePhoto(os.path.join(bench.root, name), size)
+        commands = [f'get {name}'] * bench.args.repeat
+        results.append(runCommands(bench, f'get {size // 1024} KB', commands, fileBytes=size))
+    return results
+
+
+def mixedWorkload(bench: Bench) -> list:
+    """
+    Сессии клиента: вход, переход по каталогам, просмотр и скачивание небольших фото, выход
+    """
+    directory = os.path.join(bench.root, 'album')
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for index in range(20):
+        names.append(f'mixed{index}.jpg')
+        makePhoto(os.path.join(directory, names[-1]), random.randint(10 * 1024, 512 * 1024))
+    commands = []
+    for _ in range(bench.args.repeat):
+        commands += ['quit', f'auth {user} {password}', 'cd album', 'pwd', 'ls',
+                     *[f'get {name}' for name in random.sample(names, 3)], 'cd ..']
+    return [runCommands(bench, 'mixed sessions', commands)]
+
+
+def checksumWorkload(bench: Bench) -> list:
+    """
+    Запросы с испорченной контрольной суммой: сервер отвечает 199, клиент повторяет запрос
+    """
+    name = 'checksum.jpg'
+    makePhoto(os.path.join(bench.root, name), 64 * 1024)
+    commands = ['pwd', 'ls', f'get {name}'] * bench.args.repeat
+    results = [runCommands(bench, f'checksum failures {bench.args.corrupt_rate:.0%}', commands,
+                           bench.args.corrupt_rate)]
+
+    # Скорость самих алгоритмов контрольной суммы на блоке размером с часть файла
+    block = os.urandom(bench.args.chunk_size or 1024 * 1024)
+    for algorithm, checkSum in CheckSum.algorithms.items():
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(bench.args.repeat * 10):
+            blockStart = time.perf_counter()
+            checkSum(block)
+            latencies.append(time.perf_counter() - blockStart)
+        elapsed = time.perf_counter() - start
+        results.append(result(f'CheckSum {algorithm}', latencies, len(block) * len(latencies), elapsed))
+    return results
+
+
+workloads = {
+    'ls': lsWorkload,
+    'get': getWorkload,
+    'mixed': mixedWorkload,
+    'checksum': checksumWorkload
+}
+
+
+def runWorkload(workload: str, args) -> list:
+    """
+    Выполнение одного теста на отдельных сервере и фотобазе. Запускается в отдельном процессе, чтобы пиковая память
+    процесса относилась только к этому тесту
+    :param workload: название теста из workloads
+    :param args: параметры командной строки
+    :return: список итогов теста
+    """
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        root = os.path.join(directory, 'photoBase')
+        os.makedirs(root)
+        bench = Bench(root, args)
+        try:
+            return workloads[workload](bench)
+        finally:
+            bench.close()
+
+
+def parseSize(value: str) -> int:
+    """
+    Размер с суффиксом K или M, например '10K' или '50M'
+    """
+    multipliers = {'K': 1024, 'M': 1024 * 1024}
+    suffix = value[-1].upper()
+    if suffix in multipliers:
+        return int(value[:-1]) * multipliers[suffix]
+    return int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочные тесты сервера фотографий')
+    parser.add_argument('--workloads', nargs='+', choices=list(workloads), default=list(workloads))
+    parser.add_argument('--baudrate', type=int, default=None,
+                        help='скорость имитируемой последовательной линии, по умолчанию - без ограничения')
+    parser.add_argument('--mode', choices=photoAlbumServer.transferModes, default='binary')
+    parser.add_argument('--checksum', choices=list(CheckSum.algorithms),
+                        help='по умолчанию - crc32 в двоичном режиме, xor в текстовом')
+    parser.add_argument('--chunk-size', type=parseSize, default=parseSize('60K'))
+    parser.add_argument('--cache-size', type=parseSize, default=parseSize('16M'))
+    parser.add_argument('--ls-sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--get-sizes', type=parseSize, nargs='+', default=[parseSize(size) for size in
+                                                                       ('10K', '100K', '1M', '10M', '50M')])
+    parser.add_argument('--corrupt-rate', type=float, default=0.2, help='доля запросов с испорченной суммой')
+    parser.add_argument('--repeat', type=int, default=5, help='количество повторов каждого запроса')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--json', help='путь к файлу для сохранения результатов в JSON')
+    args = parser.parse_args()
+    if args.checksum is None:
+        args.checksum = 'crc32' if args.mode == 'binary' else CheckSum.textAlgorithms[0]
+    if args.mode == 'text' and args.checksum not in CheckSum.textAlgorithms:
+        parser.error(f'checksum {args.checksum} is available only in binary mode')
+
+    results = []
+    for workload in args.workloads:
+        # Новый процесс на каждый тест: ru_maxrss - максимум за всё время жизни процесса
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            results += executor.submit(runWorkload, workload, args).result()
+        print(f'{workload} done', file=sys.stderr)
+
+    print(f'{"test":<36}{"requests":>9}{"req/s":>10}{"MB/s":>10}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}'
+          f'{"RSS MB":>9}')
+    for item in results:
+        rss = 'n/a' if item['peakRssMB'] is None else f'{item["peakRssMB"]:.1f}'
+        print(f'{item["name"]:<36}{item["requests"]:>9}{item["requestsPerSecond"]:>10.1f}'
+              f'{item["throughputMBps"]:>10.2f}{item["p50ms"]:>10.2f}{item["p90ms"]:>10.2f}{item["p99ms"]:>10.2f}'
+              f'{rss:>9}')
+    if args.json:
+        with open(args.json, 'w') as jsonFile:
+            json.dump({'arguments': vars(args), 'results': results}, jsonFile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
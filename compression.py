@@ -0,0 +1,84 @@
+import zlib
+import lzma
+import threading
+
+
+def zlib_compress(data: bytes):
+    """
+    Сжатие алгоритмом deflate (zlib)
+    :param data: байтовая строка
+    :return: сжатые данные в формате zlib
+    """
+    return zlib.compress(data, 6)
+
+
+def lzma_compress(data: bytes):
+    """
+    Сжатие алгоритмом LZMA - сильнее zlib, но медленнее
+    :param data: байтовая строка
+    :return: сжатые данные в формате xz
+    """
+    return lzma.compress(data, preset=1)
+
+
+# Алгоритмы сжатия, которые клиент может выбрать по имени: (номер алгоритма в кадре, функция сжатия).
+# Номер 0 в кадре означает, что тело не сжато
+codecs = {
+    'zlib': (1, zlib_compress),
+    'lzma': (2, lzma_compress)
+}
+
+# Тела короче этого размера не сжимаются: выигрыш меньше заголовка формата сжатия
+minCompressSize = 64
+
+
+def compressBody(codec: str, body: bytes, stats=None) -> bytes:
+    """
+    Сжатие тела кадра. Сжатое тело отправляется, только если оно короче исходного
+    :param codec: название алгоритма из codecs
+    :param body: тело кадра
+    :param stats: CompressionStats для учёта сэкономленных байт или None
+    :return: байт с номером алгоритма (0 - без сжатия) и тело кадра
+    """
+    codecId, compress = codecs[codec]
+    compressed = compress(body) if len(body) >= minCompressSize else body
+    if len(compressed) >= len(body):
+        compressed, codecId = body, 0
+    if stats is not None:
+        stats.record(codec, len(body), len(compressed))
+    return codecId.to_bytes(1, byteorder='little') + compressed
+
+
+class CompressionStats:
+    """
+    Счётчики сжатия по алгоритмам: сколько байт было до и после сжатия
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, codec: str, originalSize: int, sentSize: int):
+        """
+        Учёт одного кадра
+        :param codec: название алгоритма
+        :param originalSize: размер тела до сжатия
+        :param sentSize: размер отправленного тела - сжатого или исходного, если сжатие не помогло
+        """
+        with self._lock:
+            counters = self._counters.setdefault(codec, [0, 0, 0, 0])
+            counters[0] += 1
+            counters[1] += sentSize < originalSize
+            counters[2] += originalSize
+            counters[3] += sentSize
+
+    def stats(self) -> dict:
+        """
+        Статистика сжатия
+        :return: словарь: название алгоритма - количество кадров, количество сжатых кадров,
+        байт до сжатия, байт после сжатия и сэкономленные байты
+        """
+        with self._lock:
+            return {codec: {'frames': frames, 'compressed': compressed, 'originalBytes': originalBytes,
+                            'sentBytes': sentBytes, 'savedBytes': originalBytes - sentBytes}
+                    for codec, (frames, compressed, originalBytes, sentBytes) in self._counters.items()}
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+
+
+class Connection:
+    """
+    Соединение сервера с одним клиентом: порт, сессия клиента и согласованные параметры передачи
+    """
+
+    def __init__(self, port, name: str, checkSum, retransmitBytes: int = 0):
+        """
+        :param port: открытый порт - объект с методами read, readline, write, writelines и close
+        :param name: название порта, используется в сообщениях сервера
+        :param checkSum: функция контрольной суммы, используемая до согласования другой командой hello
+        :param retransmitBytes: объём буфера последних отправленных кадров с номерами в байтах,
+        из которого кадры отправляются повторно командой resend. 0 - буфер отключён
+        """
+        self.port = port
+        self.name = name
+        self.session = None
+        # Двоичный режим передачи включается клиентом командой hello
+        self.binaryMode = False
+        self.checkSum = checkSum
+        # Алгоритм сжатия тел ответов из compression.codecs, согласованный командой hello. None - без сжатия
+        self.compression = None
+        # Параметры передачи, согласованные командой hello и ещё не применённые
+        self.pendingOptions = {}
+        # Очередь обработки запросов с номерами: запросы выполняются по порядку, пока читаются следующие
+        self.pipeline = None
+
+        self.retransmitBytes = retransmitBytes
+        self._sentFrames = OrderedDict()
+        self._sentBytes = 0
+
+    def rememberFrame(self, sequence: int, index: int, frame: bytes):
+        """
+        Сохранение отправленного кадра для повторной отправки. При переполнении буфера удаляются самые старые кадры
+        :param sequence: номер запроса
+        :param index: номер кадра в ответе на запрос
+        :param frame: кадр, готовый к записи в порт
+        """
+        if len(frame) > self.retransmitBytes:
+            return
+        self._sentFrames[(sequence, index)] = frame
+        self._sentBytes += len(frame)
+        while self._sentBytes > self.retransmitBytes:
+            _, oldFrame = self._sentFrames.popitem(last=False)
+            self._sentBytes -= len(oldFrame)
+
+    def sentFrame(self, sequence: int, index: int):
+        """
+        Получение ранее отправленного кадра
+        :param sequence: номер запроса
+        :param index: номер кадра в ответе на запрос
+        :return: кадр или None, если кадра нет в буфере
+        """
+        return self._sentFrames.get((sequence, index))
@@ -0,0 +1,144 @@
+import os
+import hmac
+import time
+import hashlib
+import threading
+
+
+class CredentialStore:
+    """
+    Хранилище учётных данных клиентов.
+    Файл пользователей читается при создании хранилища и перечитывается только после изменения.
+    Пароль, записанный открытым текстом, хэшируется с солью при первой проверке этого логина,
+    после неё в памяти хранится только хэш. Неверные попытки входа ограничиваются
+    """
+
+    # Префикс строки с хэшем пароля в файле пользователей
+    hashPrefix = 'pbkdf2_sha256'
+
+    def __init__(self, path: str = 'users.txt', iterations: int = 20000,
+                 maxFailures: int = 5, lockoutSeconds: float = 60):
+        """
+        :param path: путь к файлу пользователей. Каждая строка - логин и пароль через пробел.
+        Пароль может быть записан открытым текстом или хэшем, полученным методом hashPassword
+        :param iterations: количество итераций PBKDF2 для паролей, записанных открытым текстом
+        :param maxFailures: количество неверных попыток подряд, после которого вход блокируется
+        :param lockoutSeconds: время блокировки входа в секундах
+        """
+        self.path = path
+        self.iterations = iterations
+        self.maxFailures = maxFailures
+        self.lockoutSeconds = lockoutSeconds
+        self._users = {}
+        self._fileVersion = None
+        # Неверные попытки: логин -> (количество попыток подряд, время последней попытки)
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._reloadIfChanged()
+
+    @staticmethod
+    def hashPassword(password: str, iterations: int = 20000, salt: bytes = None) -> str:
+        """
+        Хэширование пароля для записи в файл пользователей
+        :param password: пароль
+        :param iterations: количество итераций PBKDF2
+        :param salt: соль, по умолчанию - 16 случайных байт
+        :return: строка вида 'pbkdf2_sha256$итерации$соль$хэш'
+        """
+        salt = salt or os.urandom(16)
+        passwordHash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+        return f'{CredentialStore.hashPrefix}${iterations}${salt.hex()}${passwordHash.hex()}'
+
+    @staticmethod
+    def _parsePassword(password: str):
+        """
+        Преобразование пароля из файла в запись хранилища
+        :param password: пароль открытым текстом или строка, полученная методом hashPassword
+        :return: кортеж - количество итераций, соль, хэш пароля; или строка - пароль открытым текстом,
+        который хэшируется при первой проверке
+        """
+        parts = password.split('$')
+        if len(parts) == 4 and parts[0] == CredentialStore.hashPrefix:
+            return int(parts[1]), bytes.fromhex(parts[2]), bytes.fromhex(parts[3])
+        return password
+
+    def _hashRecord(self, user: str, password: str) -> tuple:
+        """
+        Хэширование пароля, записанного открытым текстом, и замена им записи хранилища
+        :param user: логин
+        :param password: пароль открытым текстом из файла
+        :return: кортеж - количество итераций, соль, хэш пароля
+        """
+        salt = os.urandom(16)
+        record = self.iterations, salt, hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.iterations)
+        with self._lock:
+            # Если файл перечитан во время хэширования, остаётся новая запись
+            if self._users.get(user) is password:
+                self._users[user] = record
+        return record
+
+    def _reloadIfChanged(self):
+        """
+        Чтение файла пользователей, если он изменился с последнего чтения
+        """
+        try:
+            fileStat = os.stat(self.path)
+        except OSError:
+            return
+        fileVersion = (fileStat.st_mtime_ns, fileStat.st_size)
+        if fileVersion == self._fileVersion:
+            return
+        with self._lock:
+            # Файл мог перечитать другой поток, пока этот ждал блокировку
+            if fileVersion == self._fileVersion:
+                return
+            users = {}
+            with open(self.path, 'r') as usersFile:
+                for line in usersFile:
+                    dataUser = line.split()
+                    # Пустые и неполные строки пропускаются
+                    if len(dataUser) >= 2:
+                        users[dataUser[0]] = CredentialStore._parsePassword(dataUser[1])
+            self._users = users
+            self._fileVersion = fileVersion
+
+    def isLocked(self, user: str) -> bool:
+        """
+        Проверка блокировки входа после неверных попыток
+        :param user: логин
+        :return: True, если вход для логина временно заблокирован
+        """
+        with self._lock:
+            countFailures, lastFailure = self._failures.get(user, (0, 0))
+            if countFailures < self.maxFailures:
+                return False
+            if time.monotonic() - lastFailure >= self.lockoutSeconds:
+                # Время блокировки истекло - счётчик сбрасывается
+                del self._failures[user]
+                return False
+            return True
+
+    def verify(self, user: str, password: str) -> bool:
+        """
+        Проверка логина и пароля. Неверная попытка для существующего логина увеличивает счётчик блокировки
+        :param user: логин
+        :param password: пароль
+        :return: True, если логин существует и пароль верный
+        """
+        self._reloadIfChanged()
+        with self._lock:
+            record = self._users.get(user)
+        if record is None:
+            return False
+        if isinstance(record, str):
+            record = self._hashRecord(user, record)
+        iterations, salt, passwordHash = record
+        success = hmac.compare_digest(hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations),
+                                      passwordHash)
+        with self._lock:
+            if success:
+                self._failures.pop(user, None)
+            else:
+                countFailures, _ = self._failures.get(user, (0, 0))
+                self._failures[user] = (countFailures + 1, time.monotonic())
+        return success
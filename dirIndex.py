@@ -0,0 +1,151 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class DirectoryListing:
+    """
+    Классифицированное содержимое одного каталога
+    """
+
+    def __init__(self, mtime: int, directories: list, files: list, photos: list):
+        """
+        :param mtime: время изменения каталога в наносекундах на момент чтения
+        :param directories: список имён вложенных каталогов
+        :param files: список имён всех остальных элементов каталога
+        :param photos: список имён поддерживаемых файлов - подмножество files
+        """
+        self.mtime = mtime
+        self.directories = set(directories)
+        self.files = set(files)
+        self.photos = sorted(photos)
+        # Список содержимого в формате команды ls: каталоги с пометкой 'd-', поддерживаемые файлы - 'f-'.
+        # Сначала каталоги, затем файлы, внутри групп - по имени, чтобы страницы списка не зависели от порядка ОС
+        self.markers = [f'd-{name}' for name in sorted(directories)] + [f'f-{name}' for name in self.photos]
+        self.text = ' '.join(self.markers)
+        # Оценка занимаемой памяти: имена хранятся в множествах, списках и тексте ls, размер пропорционален тексту
+        self.size = len(self.text)
+
+
+class DirectoryIndex:
+    """
+    Кэш содержимого каталогов фотобазы с вытеснением давно не использованных каталогов (LRU).
+    Каталог читается через os.scandir, который возвращает тип элемента без отдельного обращения к диску.
+    Запись каталога считается устаревшей, если изменилось время изменения каталога
+    """
+
+    def __init__(self, fileExtensions: list, maxBytes: int = 16 * 1024 * 1024):
+        """
+        :param fileExtensions: список поддерживаемых расширений файлов без точки, регистр не учитывается
+        :param maxBytes: максимальный суммарный размер текстов ls хранимых каталогов в байтах.
+        Каталог больше этого размера читается при каждом обращении
+        """
+        self.fileExtensions = {extension.lower() for extension in fileExtensions}
+        self.maxBytes = maxBytes
+        self.currentBytes = 0
+        self._listings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def isSupported(self, name: str) -> bool:
+        """
+        Проверка расширения файла на поддерживаемость
+        :param name: имя файла
+        :return: True, если расширение файла поддерживается
+        """
+        return os.path.splitext(name)[1][1:].lower() in self.fileExtensions
+
+    def listing(self, path: str):
+        """
+        Получение содержимого каталога. Каталог перечитывается, только если он изменился
+        :param path: путь к каталогу
+        :return: DirectoryListing или None, если каталога не существует
+        """
+        path = os.path.normpath(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except (OSError, ValueError):
+            # ValueError - путь с нулевым байтом, такого каталога не может быть.
+            # Запись удалённого каталога больше не нужна
+            self._drop(path)
+            return None
+        with self._lock:
+            cached = self._listings.get(path)
+            if cached is not None and cached.mtime == mtime:
+                self._listings.move_to_end(path)
+                return cached
+
+        directories, files, photos = [], [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        directories.append(entry.name)
+                    else:
+                        files.append(entry.name)
+                        if self.isSupported(entry.name):
+                            photos.append(entry.name)
+        except (OSError, ValueError):
+            self._drop(path)
+            return None
+        listing = DirectoryListing(mtime, directories, files, photos)
+        self._store(path, listing)
+        return listing
+
+    def _store(self, path: str, listing: DirectoryListing):
+        """
+        Сохранение содержимого каталога. Если размер индекса превышен, вытесняются самые старые каталоги
+        :param path: нормализованный путь к каталогу
+        :param listing: содержимое каталога
+        """
+        if listing.size > self.maxBytes:
+            self._drop(path)
+            return
+        with self._lock:
+            old = self._listings.pop(path, None)
+            if old is not None:
+                self.currentBytes -= old.size
+            self._listings[path] = listing
+            self.currentBytes += listing.size
+            while self.currentBytes > self.maxBytes:
+                _, oldListing = self._listings.popitem(last=False)
+                self.currentBytes -= oldListing.size
+
+    def _drop(self, path: str):
+        """
+        Удаление каталога из индекса
+        :param path: нормализованный путь к каталогу
+        """
+        with self._lock:
+            old = self._listings.pop(path, None)
+            if old is not None:
+                self.currentBytes -= old.size
+
+    def _parentListing(self, path: str):
+        """
+        Получение содержимого каталога, в котором находится элемент
+        :param path: путь к элементу
+        :return: пара (DirectoryListing или None, имя элемента)
+        """
+        parent, name = os.path.split(os.path.normpath(path))
+        return self.listing(parent or os.curdir), name
+
+    def isDirectory(self, path: str) -> bool:
+        """
+        Проверка существования каталога
+        :param path: путь к каталогу
+        :return: True, если каталог существует
+        """
+        listing, name = self._parentListing(path)
+        if listing is None or name in (os.curdir, os.pardir):
+            # Для путей вида '..' имя элемента нельзя найти в родительском каталоге
+            return os.path.isdir(path)
+        return name in listing.directories
+
+    def isFile(self, path: str) -> bool:
+        """
+        Проверка существования файла
+        :param path: путь к файлу
+        :return: True, если файл существует
+        """
+        listing, name = self._parentListing(path)
+        return listing is not None and name in listing.files
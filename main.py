@@ -1,3 +1,4 @@
+import logging
 from photoAlbumServer import photoAlbumServer
 import serial.tools.list_ports
 
@@ -8,6 +9,8 @@ defaultSettings = {
 }
 
 if __name__ == "__main__":
+    # Запросы и ответы выводятся на уровне DEBUG, для отладки обмена уровень можно понизить
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     print('======= ПРОГРАММА-СЕРВЕР ПО РАБОТЕ С ФОТОГРАФИЯМИ =======')
     print('--- Настройки сервера по умолчанию ---')
     for setting in defaultSettings:
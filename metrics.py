@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Границы корзин гистограмм длительности в секундах
+defaultBuckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def shorten(data, limit: int = 80) -> str:
+    """
+    Сокращение запроса или ответа для журнала: содержимое файлов не выводится целиком
+    :param data: строка или байтовая строка
+    :param limit: максимальная длина результата без многоточия
+    :return: строка не длиннее limit символов и пометка о количестве пропущенных символов
+    """
+    text = data.decode(errors='replace') if isinstance(data, (bytes, bytearray)) else str(data)
+    if len(text) <= limit:
+        return text
+    return f'{text[:limit]}... (+{len(text) - limit})'
+
+
+class Histogram:
+    """
+    Гистограмма значений с фиксированными границами корзин
+    """
+
+    def __init__(self, buckets=defaultBuckets):
+        """
+        :param buckets: возрастающие верхние границы корзин
+        """
+        self.buckets = tuple(buckets)
+        # Последняя корзина - значения больше всех границ
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """
+        Учёт одного значения
+        :param value: значение
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Оценка перцентиля по границам корзин
+        :param fraction: доля от 0 до 1, например 0.99
+        :return: верхняя граница корзины, в которую попадает перцентиль, inf - если он больше всех границ
+        """
+        rank = fraction * self.count
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            if total >= rank and total:
+                return bound
+        return 0.0
+
+
+class Metrics:
+    """
+    Метрики сервера: счётчики и гистограммы с метками, а также показатели, которые собираются функциями при выгрузке.
+    Выгружаются в JSON или в текстовом формате Prometheus
+    """
+
+    def __init__(self, prefix: str = 'photo_album'):
+        """
+        :param prefix: префикс названий метрик в формате Prometheus
+        """
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._dumpStop = None
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """
+        Увеличение счётчика
+        :param name: название счётчика
+        :param value: приращение
+        :param labels: метки, например command='get'
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Учёт значения в гистограмме
+        :param name: название гистограммы
+        :param value: значение, для длительностей - в секундах
+        :param labels: метки
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Измерение длительности блока кода в гистограмму
+        :param name: название гистограммы
+        :param labels: метки
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def addCollector(self, collector):
+        """
+        Добавление источника показателей, которые не считаются сервером напрямую, например статистики кэша
+        :param collector: функция без аргументов, возвращающая словарь: название показателя - число
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        """
+        Текущие значения всех метрик
+        :return: словарь с разделами counters, histograms и gauges
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                           'p50': histogram.percentile(0.5), 'p90': histogram.percentile(0.9),
+                           'p99': histogram.percentile(0.99),
+                           'buckets': dict(zip([str(bound) for bound in histogram.buckets] + ['+Inf'],
+                                               histogram.counts))}
+                          for (name, labels), histogram in sorted(self._histograms.items())]
+        gauges = {}
+        for collector in self._collectors:
+            gauges.update(collector())
+        return {'time': time.time(), 'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    def toJson(self) -> str:
+        """
+        Выгрузка метрик в JSON
+        :return: строка JSON
+        """
+        return json.dumps(self.snapshot(), ensure_ascii=False, default=str)
+
+    def toPrometheus(self) -> str:
+        """
+        Выгрузка метрик в текстовом формате Prometheus
+        :return: строка, каждая метрика - на отдельной строке
+        """
+        def formatLabels(labels: dict, **extra) -> str:
+            labels = {**labels, **extra}
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in snapshot['counters']:
+            name = f'{self.prefix}_{counter["name"]}'
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{formatLabels(counter["labels"])} {counter["value"]}')
+        for histogram in snapshot['histograms']:
+            name = f'{self.prefix}_{histogram["name"]}'
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in histogram['buckets'].items():
+                cumulative += count
+                lines.append(f'{name}_bucket{formatLabels(histogram["labels"], le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{formatLabels(histogram["labels"])} {histogram["sum"]}')
+            lines.append(f'{name}_count{formatLabels(histogram["labels"])} {histogram["count"]}')
+        for gauge, value in sorted(snapshot['gauges'].items()):
+            name = f'{self.prefix}_{gauge}'
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        """
+        Запись метрик в файл через временный файл. Формат выбирается по расширению: '.json' - JSON,
+        иначе - текстовый формат Prometheus
+        :param path: путь к файлу
+        """
+        text = self.toJson() if path.endswith('.json') else self.toPrometheus()
+        temporaryPath = path + '.tmp'
+        with open(temporaryPath, 'w', encoding='utf-8') as metricsFile:
+            metricsFile.write(text)
+        os.replace(temporaryPath, path)
+
+    def startDump(self, path: str, interval: float = 60):
+        """
+        Периодическая запись метрик в файл в фоновом потоке
+        :param path: путь к файлу
+        :param interval: период записи в секундах
+        :return: фоновый поток
+        """
+        self.stopDump()
+        stop = self._dumpStop = threading.Event()
+
+        def dumpLoop():
+            while not stop.wait(interval):
+                self.dump(path)
+            # Итоговые значения записываются при остановке
+            self.dump(path)
+
+        thread = threading.Thread(target=dumpLoop, daemon=True)
+        thread.start()
+        return thread
+
+    def stopDump(self):
+        """
+        Остановка периодической записи метрик
+        """
+        if self._dumpStop is not None:
+            self._dumpStop.set()
+            self._dumpStop = None
@@ -1,18 +1,48 @@
 import os
+import mmap
+import logging
 import base64
+import fnmatch
+import itertools
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Union, Any
 from session import Session
+from connection import Connection
+from photoCache import PhotoCache
+from dirIndex import DirectoryIndex
+from thumbnails import ThumbnailCache
+from credentials import CredentialStore
 import serial
 import time
 import serial.tools.list_ports
 from serial import PARITY_ODD
 import CheckSum
+import compression
+from metrics import Metrics, shorten
+
+logger = logging.getLogger(__name__)
 
 
 class photoAlbumServer:
     # Поддерживаемые форматы файлов
     supportedFileExtensions = ['jpeg', 'jpg', 'gif', 'png']
 
+    # Режимы передачи сообщений: текстовый (строки с base64) и двоичный (кадры с длиной)
+    transferModes = ['text', 'binary']
+
+    # Максимальный размер тела запроса в байтах
+    maxRequestSize = 1024
+
+    # Максимальный размер большей стороны уменьшенной копии фото в пикселях
+    maxThumbnailSide = 1024
+    # Файлы от этого размера отображаются в память, меньшие - читаются блоками:
+    # для маленьких файлов создание отображения обходится дороже чтения
+    mmapThreshold = 1024 * 1024
+    # Большой файл отображается окнами такого размера, чтобы в памяти процесса не оказался весь файл
+    mmapWindow = 8 * 1024 * 1024
+
     # Коды сообщений
     codes = {
         0: "Part of file",
@@ -23,7 +53,10 @@ class photoAlbumServer:
         101: "ERR Authorisation Error",
         102: "ERR Invalid command format",
         103: "ERR Unsupported file",
-        104: "ERR File could not be sent"
+        104: "ERR File could not be sent",
+        105: "ERR Invalid range",
+        106: "ERR Too many attempts",
+        107: "ERR Frame is not available"
     }
 
     @staticmethod
@@ -54,31 +87,92 @@ class photoAlbumServer:
     def __init__(self,
                  inputPathToPhotoBase: str = 'photoBase',
                  checkSum=CheckSum.simple_checksum,
-                 fileExtensions: list = None):
+                 fileExtensions: list = None,
+                 chunkSize: int = None,
+                 cacheSize: int = 16 * 1024 * 1024,
+                 thumbnailSide: int = 128,
+                 pregenerateThumbnails: bool = False,
+                 workers: int = 4,
+                 usersFile: str = 'users.txt',
+                 retransmitBytes: int = 1024 * 1024,
+                 metricsFile: str = None,
+                 metricsInterval: float = 60):
         """
         Инициализация экземпляра сервера
         :param inputPathToPhotoBase: строка - путь к каталогу файлов
-        :param checkSum: функция - проверка контрольной суммы.
+        :param checkSum: функция - проверка контрольной суммы, или имя алгоритма из CheckSum.algorithms.
         Функция должна принимать 1 аргумент - битовую строку, которую нужно проверить.
-        Функция должна возвращать значение контрольной суммы, типа int.
+        Функция должна возвращать значение контрольной суммы, типа int, не более 4 байт.
+        Соединения начинаются в текстовом режиме, поэтому из CheckSum.algorithms допустимы только алгоритмы
+        из CheckSum.textAlgorithms. Клиент может выбрать другой алгоритм из CheckSum.algorithms командой hello.
         :param fileExtensions: список с элементами типа str,
         элемент - имя расширения файла, которое сервер должен поддерживать.
         Имя расширения файла должно быть без точки в начале! Например: 'JPG', 'gif' и т.п.
         Расширение не регистрозависимое.
+        :param chunkSize: размер блока файла в байтах для потоковой передачи командой get.
+        Если значение задано, файл читается и отправляется по частям - сообщениями с кодом 000.
+        Размер округляется вниз до числа, кратного 3, чтобы части кодировались base64 без дополнения.
+        Если значение не задано, файл отправляется одним сообщением.
+        :param cacheSize: объём кэша закодированных фото в байтах. 0 - кэш отключён
+        :param thumbnailSide: размер большей стороны уменьшенной копии фото по умолчанию для команды thumb.
+        Копии хранятся в каталоге '<имя каталога файлов>.thumbnails' рядом с каталогом файлов
+        :param pregenerateThumbnails: True - создать копии для всех фото в фоновом потоке при запуске сервера
+        :param workers: количество потоков общего пула, в котором выполняются команды, чтение и кодирование файлов
+        для всех портов
+        :param usersFile: путь к файлу пользователей - строки с логином и паролем (или его хэшем) через пробел
+        :param retransmitBytes: объём буфера отправленных кадров с номерами для каждого соединения в байтах,
+        из которого кадры отправляются повторно командой resend
+        :param metricsFile: путь к файлу, в который периодически выгружаются метрики сервера.
+        Расширение '.json' - формат JSON, иначе - текстовый формат Prometheus. None - метрики не выгружаются
+        :param metricsInterval: период выгрузки метрик в секундах
         """
-        self.port = None
-        self.waitingFlag = False
+        if isinstance(checkSum, str):
+            if checkSum not in CheckSum.algorithms:
+                raise ValueError(f'Checksum algorithm {checkSum} is not supported')
+            checkSum = CheckSum.algorithms[checkSum]
+        if any(checkSum is CheckSum.algorithms[name] for name in CheckSum.algorithms
+               if name not in CheckSum.textAlgorithms):
+            # Байты этих сумм могут разбить текстовые кадры, а соединения начинаются в текстовом режиме
+            raise ValueError('Checksum algorithm is available only in binary mode, select it with hello')
         self.checkSum = checkSum
 
+        if chunkSize is not None:
+            chunkSize -= chunkSize % 3
+            if chunkSize <= 0:
+                raise ValueError('Too small chunk size')
+        self.chunkSize = chunkSize
+        self.photoCache = PhotoCache(cacheSize)
+
+        # Соединения с клиентами на всех портах сервера
+        self.connections = []
+        self.waitingFlag = False
+        self.workers = ThreadPoolExecutor(max_workers=workers)
+        self.credentials = CredentialStore(usersFile)
+        self.retransmitBytes = retransmitBytes
+        # Сэкономленные сжатием байты по алгоритмам
+        self.compressionStats = compression.CompressionStats()
+        self.metrics = Metrics()
+        self.metrics.addCollector(self._collectMetrics)
+        if metricsFile is not None:
+            self.metrics.startDump(metricsFile, metricsInterval)
+
         if fileExtensions is not None:
             photoAlbumServer._checkFileExtensions(fileExtensions)
         else:
             fileExtensions = photoAlbumServer.supportedFileExtensions
         self.fileExtensions = fileExtensions
+        self.directoryIndex = DirectoryIndex(fileExtensions)
 
         if photoAlbumServer._checkDirectory(inputPathToPhotoBase):
             splittenPath = inputPathToPhotoBase.split('\\')
-            Session.directoryStart = splittenPath[-1]
+            self.directoryStart = splittenPath[-1]
+
+        if not 0 < thumbnailSide <= photoAlbumServer.maxThumbnailSide:
+            raise ValueError('Invalid thumbnail side')
+        pathToPhotoBase = os.path.abspath(inputPathToPhotoBase)
+        self.thumbnailCache = ThumbnailCache(pathToPhotoBase + '.thumbnails', thumbnailSide)
+        if pregenerateThumbnails and ThumbnailCache.isAvailable():
+            self.thumbnailCache.startPregeneration(pathToPhotoBase, self.directoryIndex.isSupported)
 
         # Словарь поддерживаемых команд сервера
         self.commands = {
@@ -87,134 +181,560 @@ class photoAlbumServer:
             'ls': self._ls,
             'cd': self._cd,
             'get': self._get,
+            'mget': self._mget,
+            'parts': self._parts,
+            'thumb': self._thumb,
             'hello': self._hello,
+            'resend': self._resend,
             'quit': self._quit
         }
 
-        self.currentSession = None
-
     def start(self, portName='COM1', baudrate=9600):
         """
-        Запуск сервера
-        :param portName: название порта для подключения
+        Запуск сервера. Метод возвращает управление после остановки прослушки всех портов
+        :param portName: название порта для подключения или список названий.
+        Кроме COM-портов поддерживаются адреса pyserial, например 'loop://' или 'socket://localhost:7777'
         :param baudrate: скорость передачи данных
         """
-        if portName[:3] != 'COM':
-            raise ValueError('Only COM ports are supported')
+        portNames = [portName] if isinstance(portName, str) else list(portName)
         if baudrate < 100:
             raise ValueError('Too small baudrate')
-        # Получение списка доступных портов
-        ports = serial.tools.list_ports.comports()
-        portsList = [port.device for port in ports]
-        if portName.upper() in portsList:
-            # Если заданный порт доступен, он открывается и начинается "прослушка" порта
-            self.port = serial.Serial(portName.upper(), baudrate=baudrate, parity=PARITY_ODD, timeout=None)
-            print(f'Server is running on port {portName}')
-            self.waitingFlag = True
-            self._listen()
-        else:
-            raise Exception(f'Port {portName} not detected')
+        # Проверка всех портов до открытия первого из них
+        portsList = [port.device for port in serial.tools.list_ports.comports()]
+        for name in portNames:
+            if '://' in name:
+                continue
+            if name[:3] != 'COM':
+                raise ValueError('Only COM ports are supported')
+            if name.upper() not in portsList:
+                raise Exception(f'Port {name} not detected')
+
+        # Для каждого порта создаётся своё соединение, которое прослушивается в отдельном потоке
+        self.waitingFlag = True
+        threads = []
+        for name in portNames:
+            if '://' in name:
+                port = serial.serial_for_url(name, baudrate=baudrate, parity=PARITY_ODD, timeout=None)
+            else:
+                port = serial.Serial(name.upper(), baudrate=baudrate, parity=PARITY_ODD, timeout=None)
+            logger.info('Server is running on port %s', name)
+            connection = Connection(port, name, self.checkSum, self.retransmitBytes)
+            self.connections.append(connection)
+            threads.append(threading.Thread(target=self._listen, args=(connection,), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
     def close(self):
         """
         Закрытие сервера
         """
-        if self.port is not None:
-            self.port.close()
         self.waitingFlag = False
+        for connection in self.connections:
+            connection.port.close()
+        self.connections = []
+        self.metrics.stopDump()
+
+    def _collectMetrics(self) -> dict:
+        """
+        Показатели кэшей и сжатия для выгрузки метрик
+        :return: словарь: название показателя - число
+        """
+        cacheStats = self.photoCache.stats()
+        lookups = cacheStats['hits'] + cacheStats['misses']
+        gauges = {
+            'photo_cache_hits': cacheStats['hits'],
+            'photo_cache_misses': cacheStats['misses'],
+            'photo_cache_entries': cacheStats['entries'],
+            'photo_cache_bytes': cacheStats['bytes'],
+            'photo_cache_hit_ratio': cacheStats['hits'] / lookups if lookups else 0.0,
+            'connections': len(self.connections)
+        }
+        for codec, codecStats in self.compressionStats.stats().items():
+            gauges[f'compression_{codec}_original_bytes'] = codecStats['originalBytes']
+            gauges[f'compression_{codec}_saved_bytes'] = codecStats['savedBytes']
+        return gauges
 
-    def _listen(self):
+    def _listen(self, connection: Connection):
         """
-        Обработка приходящих сообщений
+        Обработка приходящих сообщений на одном порту
+        :param connection: соединение с клиентом
         """
-        print('Server > I`m ready to listen')
+        logger.info('Server > I`m ready to listen %s', connection.name)
+        connection.pipeline = ThreadPoolExecutor(max_workers=1)
         while self.waitingFlag:
             # Прослушка порта
-            request = self.port.readline().decode().rstrip('\n')
-            print(f'Server > Get "{request}"')
-            # Обработка запроса от клиента
-            response = self.sessionCommand(request)
-            # Отправка ответа на запрос
-            self._send(response)
+            try:
+                process, sequence, waitResponse = self._readRequest(connection)
+            except (serial.SerialException, OSError):
+                # Клиент отключился или порт закрыт методом close
+                if self.waitingFlag:
+                    logger.warning('Server > %s > Connection lost', connection.name)
+                break
+            except (TypeError, AttributeError):
+                # Порт, закрытый методом close в другом потоке, pyserial может сообщить не через SerialException
+                if self.waitingFlag:
+                    logger.exception('Server > %s > Failed to read request', connection.name)
+                break
+            # Обработка запроса и отправка ответа выполняются по порядку в очереди соединения
+            done = connection.pipeline.submit(self._process, connection, process, sequence)
+            if waitResponse:
+                try:
+                    done.result()
+                except (serial.SerialException, OSError):
+                    if self.waitingFlag:
+                        logger.warning('Server > %s > Connection lost', connection.name)
+                    break
+                except Exception:
+                    # Запись в порт, закрытый методом close, может вызвать и другие исключения
+                    if not self.waitingFlag:
+                        break
+                    logger.exception('Server > %s > Response failed', connection.name)
+            else:
+                done.add_done_callback(functools.partial(photoAlbumServer.logFailure, connection))
+        connection.pipeline.shutdown(wait=False)
+
+    def _readRequest(self, connection: Connection) -> tuple:
+        """
+        Чтение одного запроса из порта
+        :param connection: соединение с клиентом
+        :return: результат requestParser
+        """
+        parser = self.requestParser(connection)
+        data = None
+        while True:
+            try:
+                size = parser.send(data)
+            except StopIteration as stop:
+                return stop.value
+            data = connection.port.readline() if size is None else connection.port.read(size)
+            # Порт открыт без тайм-аута: меньше данных, чем запрошено, приходит только после закрытия порта
+            if size is not None and len(data) < size:
+                raise ConnectionError('Port is closed')
+
+    def requestParser(self, connection: Connection):
+        """
+        Разбор одного запроса, не зависящий от способа чтения: общий для транспорта на потоках и для asyncio.
+        Генератор отдаёт, что нужно прочитать: количество байт или None - строку до символа '\\n' включительно,
+        и получает прочитанные байты. Транспорт должен передавать ровно запрошенное количество байт.
+        Кадр двоичного запроса: 4 байта - длина тела (little-endian), тело запроса, 4 байта - контрольная сумма тела
+        :param connection: соединение с клиентом
+        :return: через StopIteration - тройка: функция без аргументов, выполняющая запрос; номер запроса или None;
+        True, если ответ нужно отправить до чтения следующего запроса
+        """
+        if connection.binaryMode:
+            length = int.from_bytes((yield 4), byteorder='little')
+            if length > photoAlbumServer.maxRequestSize:
+                # Слишком длинный кадр пропускается целиком, чтобы не потерять границу следующего кадра
+                left = length + 4
+                while left > 0:
+                    left -= len((yield min(left, photoAlbumServer.maxRequestSize)))
+                body, process = '', functools.partial(tuple, ((102, ''),))
+            else:
+                package = yield length
+                inputSum = yield 4
+                body = package.decode(errors='replace')
+                process = functools.partial(self.binaryCommand, connection, package, inputSum)
+        else:
+            line = yield None
+            if not line:
+                raise ConnectionError('Connection is closed')
+            # После '. ' идут 4 байта контрольной суммы и '\n'. Если байт суммы совпал с '\n', строка закончилась
+            # внутри суммы: оставшиеся байты суммы и '\n' дочитываются
+            tail = len(line) - line.rfind(b'. ') - 2
+            if b'. ' in line and tail < 5:
+                line += yield 5 - tail
+            # Байты контрольной суммы могут не быть символами UTF-8: они сохраняются без изменений
+            body = line.decode(errors='surrogateescape').rstrip('\n')
+            logger.debug('Server > %s > Get "%s"', connection.name, shorten(body))
+            process = functools.partial(self.sessionCommand, connection, body)
+        sequence = photoAlbumServer.requestSequence(body)
+        # Запросы без номера и команда hello, меняющая формат следующих запросов, выполняются по одному.
+        # Следующий запрос с номером читается, не дожидаясь ответа на предыдущий
+        return process, sequence, sequence is None or photoAlbumServer.isHelloRequest(body)
+
+    def _process(self, connection: Connection, process, sequence: int = None):
+        """
+        Обработка запроса в общем пуле потоков и отправка ответа
+        :param connection: соединение с клиентом
+        :param process: функция без аргументов, выполняющая запрос и возвращающая ответ
+        :param sequence: номер запроса или None
+        """
+        response = self.workers.submit(self.executeRequest, connection, process).result()
+        self._send(connection, response, sequence)
+        # Смена параметров передачи после отправки ответа на команду hello
+        self.applyPendingOptions(connection)
+
+    def executeRequest(self, connection: Connection, process):
+        """
+        Выполнение запроса. Ошибка обработчика команды не завершает соединение: она записывается в журнал,
+        а клиент получает ответ с кодом 104
+        :param connection: соединение с клиентом
+        :param process: функция без аргументов, выполняющая запрос и возвращающая ответ
+        :return: ответ - кортеж или итератор из пар: код ответа, сообщение
+        """
+        try:
+            response = process()
+        except Exception:
+            logger.exception('Server > %s > Request failed', connection.name)
+            return (104, ''),
+        if isinstance(response, tuple):
+            return response
+        # Части файла читаются при отправке, ошибка чтения завершает ответ кадром с кодом 104
+        return photoAlbumServer._guardResponse(connection, response)
+
+    @staticmethod
+    def _guardResponse(connection: Connection, response):
+        """
+        Итератор ответа, который при ошибке обработчика заканчивается ответом с кодом 104
+        :param connection: соединение с клиентом
+        :param response: итератор ответа
+        :return: итератор тех же элементов ответа
+        """
+        try:
+            yield from response
+        except Exception:
+            logger.exception('Server > %s > Response failed', connection.name)
+            yield 104, ''
+
+    @staticmethod
+    def logFailure(connection: Connection, done):
+        """
+        Запись в журнал ошибки обработки запроса с номером, результат которой никто не ожидает
+        :param connection: соединение с клиентом
+        :param done: завершённая задача обработки запроса - concurrent.futures.Future или asyncio.Task
+        """
+        if not done.cancelled() and done.exception() is not None:
+            logger.warning('Server > %s > Response is not sent: %r', connection.name, done.exception())
 
-    def _send(self, response):
+    @staticmethod
+    def requestSequence(body: str):
+        """
+        Получение номера запроса. Номер записывается в начале запроса: '#НОМЕР КОМАНДА АРГУМЕНТЫ. КС'
+        :param body: строка - запрос
+        :return: номер запроса или None, если запрос без номера
+        """
+        if not body.startswith('#'):
+            return None
+        token = body.split(' ', 1)[0][1:]
+        return int(token) if token.isdigit() else None
+
+    @staticmethod
+    def isHelloRequest(body: str) -> bool:
+        """
+        Проверка, является ли запрос командой hello
+        :param body: строка - запрос
+        :return: True, если команда запроса - hello
+        """
+        words = body.split(' ', 2)
+        if body.startswith('#'):
+            words = words[1:]
+        return bool(words) and words[0].split('.')[0] == 'hello'
+
+    def _readAhead(self, frames):
+        """
+        Получение кадров ответа с подготовкой следующего кадра в общем пуле потоков.
+        Пока отправляется текущая часть файла, следующая уже читается и кодируется
+        :param frames: итератор кадров
+        :return: итератор тех же кадров
+        """
+        nextFrame = self.workers.submit(next, frames, None)
+        while (frame := nextFrame.result()) is not None:
+            nextFrame = self.workers.submit(next, frames, None)
+            yield frame
+
+    @staticmethod
+    def applyPendingOptions(connection: Connection):
+        """
+        Применение параметров передачи, согласованных командой hello
+        :param connection: соединение с клиентом
+        """
+        if 'mode' in connection.pendingOptions:
+            connection.binaryMode = connection.pendingOptions['mode'] == 'binary'
+        if 'checksum' in connection.pendingOptions:
+            connection.checkSum = CheckSum.algorithms[connection.pendingOptions['checksum']]
+        if 'compress' in connection.pendingOptions:
+            codec = connection.pendingOptions['compress']
+            connection.compression = None if codec == 'none' else codec
+        if not connection.binaryMode:
+            # Сжатые тела не могут передаваться в текстовом режиме
+            connection.compression = None
+        connection.pendingOptions = {}
+
+    def _send(self, connection: Connection, response, sequence: int = None):
         """
         Отправка сообщений с сервера
-        :param response: кортеж содержащий пару (код, сообщение)
+        :param connection: соединение с клиентом
+        :param response: кортеж содержащий пару (код, сообщение).
+        Вместо пары может быть тройка (код, сообщение, контрольная сумма сообщения в байтах)
+        :param sequence: номер запроса, которым помечаются кадры ответа, или None
         """
-        for code, message in response:
-            package = ''
+        frames = self.responseFrames(connection, response, sequence)
+        if not isinstance(response, tuple):
+            # Части файла готовятся заранее, пока отправляется предыдущая
+            frames = self._readAhead(frames)
+        sentBytes = 0
+        with self.metrics.timer('send_seconds'):
+            for frame in frames:
+                connection.port.write(frame)
+                sentBytes += len(frame)
+        self.metrics.increment('bytes_sent_total', sentBytes)
+
+    def responseFrames(self, connection: Connection, response, sequence: int = None):
+        """
+        Формирование кадров ответа для отправки в порт. Не зависит от способа передачи
+        :param connection: соединение с клиентом
+        :param response: кортеж или итератор из пар (код, сообщение) или троек
+        (код, сообщение, контрольная сумма сообщения в байтах).
+        Элемент типа bytes или bytearray - уже готовый кадр, например повторно отправляемый командой resend.
+        Элемент типа list - часть файла для кэша [код, сообщение, None]: после сборки кадра в нём сохраняются
+        сообщение внутри кадра и контрольная сумма, если она вычислена для сообщения без метки и сжатия
+        :param sequence: номер запроса или None. Если номер задан, каждый кадр начинается с метки
+        '#НОМЕР_ЗАПРОСА:НОМЕР_КАДРА ' и сохраняется для повторной отправки
+        :return: итератор кадров - байтовых строк (bytearray), готовых к записи
+        """
+        for index, item in enumerate(response):
+            if isinstance(item, (bytes, bytearray)):
+                yield item
+                continue
+            code, message, *precomputedSum = item
             if code != 0:
-                package = f'{code} {photoAlbumServer.codes[code]}'
-                if message:
-                    package += f'. '
-            else:
-                package = '000 '
-            package += f'{message}. '
-            package = package.encode()
-            self.port.writelines([package + self.checkSum(package).to_bytes(4, byteorder='little') + '\n'.encode()])
-            print(f'Server > Send "{package.decode() + self.checkSum(package).to_bytes(4, byteorder="little").decode()}"')
-            # time.sleep(1)
+                self.metrics.increment('responses_total', code=code)
+            if isinstance(message, str):
+                message = message.encode()
+            head = photoAlbumServer._packageHead(code, message)
+            if sequence is not None:
+                head = f'#{sequence}:{index} '.encode() + head
+                # Готовая контрольная сумма вычислена для сообщения без метки
+                precomputedSum = None
+            pieces = (head, message, b'. ')
+            if connection.compression is not None:
+                # Тело сжимается до вычисления контрольной суммы, сумма проверяет переданные байты
+                pieces = (compression.compressBody(connection.compression, b''.join(pieces), self.compressionStats),)
+                precomputedSum = None
+            # Контрольная сумма вычисляется один раз на сообщение, для частей из кэша - берётся готовая
+            frame = photoAlbumServer._assembleFrame(connection, pieces, precomputedSum[0] if precomputedSum else None)
+            # Содержимое файла в журнал не выводится: сообщение сокращается, и только при включённом уровне DEBUG
+            if logger.isEnabledFor(logging.DEBUG):
+                description = shorten(head + message) if code != 0 else f'file part - {len(message)} bytes'
+                logger.debug('Server > %s > Send "%s" - %d bytes', connection.name, description, len(frame))
+            if isinstance(item, list) and sequence is None and connection.compression is None:
+                photoAlbumServer._keepCachedPart(connection, item, frame, len(head))
+            if sequence is not None:
+                connection.rememberFrame(sequence, index, frame)
+            yield frame
+
+    @staticmethod
+    def _keepCachedPart(connection: Connection, part: list, frame: bytearray, headSize: int):
+        """
+        Сохранение части файла для кэша из собранного кадра без отдельной копии сообщения и без повторного
+        вычисления контрольной суммы. Вызывается только для кадров без метки и сжатия: их сумма - сумма сообщения
+        :param connection: соединение с клиентом
+        :param part: список [код, сообщение, None] - заполняется сообщением внутри кадра и контрольной суммой
+        :param frame: собранный кадр
+        :param headSize: длина начала тела перед сообщением
+        """
+        start = (4 if connection.binaryMode else 0) + headSize
+        end = start + len(part[1])
+        view = memoryview(frame).toreadonly()
+        part[1] = view[start:end]
+        # После сообщения в кадре идут '. ' и контрольная сумма
+        part[2] = bytes(view[end + 2:end + 6])
 
-    def _checkSession(self):
+    @staticmethod
+    def _assembleFrame(connection: Connection, pieces: tuple, packageSum: bytes = None) -> bytearray:
+        """
+        Сборка кадра в заранее выделенном буфере. Каждая часть тела, в том числе срез отображённого в память файла,
+        копируется один раз - сразу на своё место в кадре, контрольная сумма считается по телу внутри кадра
+        :param connection: соединение с клиентом
+        :param pieces: части тела ответа - байты или memoryview
+        :param packageSum: готовая контрольная сумма тела в байтах или None
+        :return: кадр: в двоичном режиме - длина тела, тело, контрольная сумма;
+        в текстовом - тело, контрольная сумма, символ '\\n'
+        """
+        size = sum(len(piece) for piece in pieces)
+        start = 4 if connection.binaryMode else 0
+        frame = bytearray(start + size + (4 if connection.binaryMode else 5))
+        if connection.binaryMode:
+            frame[:4] = size.to_bytes(4, byteorder='little')
+        position = start
+        for piece in pieces:
+            frame[position:position + len(piece)] = piece
+            position += len(piece)
+        if packageSum is None:
+            packageSum = photoAlbumServer._checkSumOf(connection, memoryview(frame)[start:position])
+            packageSum = packageSum.to_bytes(4, byteorder='little')
+        frame[position:position + 4] = packageSum
+        if not connection.binaryMode:
+            frame[-1:] = b'\n'
+        return frame
+
+    @staticmethod
+    def _checkSumOf(connection: Connection, data) -> int:
+        """
+        Контрольная сумма данных без копирования. Алгоритмы из CheckSum.algorithms принимают memoryview,
+        функции, заданные при создании сервера, получают байтовую строку
+        :param connection: соединение с клиентом
+        :param data: байты или memoryview
+        :return: значение контрольной суммы
+        """
+        if isinstance(data, memoryview) and connection.checkSum not in CheckSum.algorithms.values():
+            data = data.tobytes()
+        return connection.checkSum(data)
+
+    @staticmethod
+    def _packageHead(code: int, message) -> bytes:
+        """
+        Начало тела ответа перед сообщением: код и статус ответа
+        :param code: код ответа
+        :param message: байты - сообщение
+        :return: байты, например b'200 OK. ' или b'000 '
+        """
+        if code == 0:
+            return b'000 '
+        head = f'{code} {photoAlbumServer.codes[code]}'
+        if message:
+            head += '. '
+        return head.encode()
+
+    def binaryCommand(self, connection: Connection, package: bytes, inputSum: bytes):
+        """
+        Обработка и выполнение команды, принятой в двоичном кадре
+        :param connection: соединение с клиентом, от которого пришёл запрос
+        :param package: байты - тело кадра
+        :param inputSum: байты - контрольная сумма из кадра
+        :return: кортеж - результат выполнения команды или проверки корректности запроса
+        """
+        logger.debug('Server > %s > Get binary frame "%s"', connection.name, shorten(package))
+
+        with self.metrics.timer('request_seconds', mode='binary'):
+            # Проверка контрольной суммы
+            if inputSum != connection.checkSum(package).to_bytes(4, byteorder="little"):
+                self.metrics.increment('checksum_failures_total')
+                return (199, ''),
+            if not package.endswith(b'. '):
+                return (102, ''),
+            try:
+                fullCommand = package[:-2].decode()
+            except UnicodeDecodeError:
+                return (102, ''),
+            return self._executeCommand(connection, fullCommand)
+
+    @staticmethod
+    def _checkSession(connection: Connection):
         """
         Проверка активности сессии
+        :param connection: соединение с клиентом
         :return: bool - True, если сессия активна, False - иначе
         """
-        return self.currentSession is not None
+        return connection.session is not None
 
-    def _checkSumFromRequest(self, package, inputSum):
+    @staticmethod
+    def _checkSumFromRequest(connection: Connection, package, inputSum):
         """
         Проверка запроса на целостность - проверка контрольной суммы
+        :param connection: соединение с клиентом
         :param package: строка - посылка (запрос) от клиента
         :param inputSum: строка - значение контрольной суммы от клиента
         :return: bool - True, если проверка прошла, False - иначе
         """
-        return inputSum.encode() == self.checkSum(package.encode()).to_bytes(4, byteorder="little")
+        return (inputSum.encode(errors='surrogateescape') ==
+                connection.checkSum(package.encode(errors='surrogateescape')).to_bytes(4, byteorder="little"))
 
-    def sessionCommand(self, request) -> Union[tuple[tuple[int, str]], Any]:
+    def sessionCommand(self, connection: Connection, request) -> Union[tuple[tuple[int, str]], Any]:
         """
         Обработка и выполнение принятых команд от клиента
-        :param command: строка, запрос от клиента
+        :param connection: соединение с клиентом, от которого пришёл запрос
+        :param request: строка, запрос от клиента
         :return: кортеж - результат выполнения команды или проверки корректности запроса
         """
+        with self.metrics.timer('request_seconds', mode='text'):
+            # Попытка разделение запроса на команду и контрольную суммы
+            try:
+                fullCommand, inputSum = request.split('. ')
+            except Exception:
+                return (102, ''),
+            # Проверка контрольной суммы
+            if not self._checkSumFromRequest(connection, fullCommand + '. ', inputSum):
+                self.metrics.increment('checksum_failures_total')
+                return (199, ''),
+            return self._executeCommand(connection, fullCommand)
 
-        # Попытка разделение запроса на команду и контрольную суммы
-        try:
-            fullCommand, inputSum = request.split('. ')
-        except Exception:
-            return (102, ''),
-        # Проверка контрольной суммы
-        if not self._checkSumFromRequest(fullCommand + '. ', inputSum):
-            return (199, ''),
-
+    def _executeCommand(self, connection: Connection, fullCommand: str):
+        """
+        Выполнение команды, прошедшей проверку контрольной суммы
+        :param connection: соединение с клиентом
+        :param fullCommand: строка - команда с аргументами, разделёнными пробелами
+        :return: кортеж - результат выполнения команды
+        """
         # Проверка поддерживаемости команды
         command, *args = fullCommand.split(' ')
+        if command.startswith('#'):
+            # Номер запроса используется только для пометки кадров ответа
+            if not command[1:].isdigit() or not args:
+                return (102, ''),
+            command, *args = args
         if command not in self.commands:
             return (102, ''),
+        self.metrics.increment('commands_total', command=command)
 
-        # Выполнение команд, доступных для не авторизированных пользователей
-        if command == 'auth':
-            return self._auth(args)
-        elif command == 'hello':
-            return self._hello()
-        else:
-            if self._checkSession():
-                # Выполнение команд, доступных для авторизированных пользователей
-                return self.commands[command](args)
+        # Для команд, передающих файлы, время включает только проверки и подготовку ответа,
+        # чтение и кодирование файла учитываются отдельно при отправке
+        with self.metrics.timer('command_seconds', command=command):
+            # Выполнение команд, доступных для не авторизированных пользователей
+            if command == 'auth':
+                return self._auth(connection, args)
+            elif command == 'hello':
+                return self._hello(connection, args)
             else:
-                # Отправка сообщения о недоступности команды
-                return (100, ''),
+                if self._checkSession(connection):
+                    # Выполнение команд, доступных для авторизированных пользователей
+                    return self.commands[command](connection, args)
+                else:
+                    # Отправка сообщения о недоступности команды
+                    return (100, ''),
 
-    def _hello(self):
+    @staticmethod
+    def _hello(connection: Connection, args=()):
         """
-        Команда - проверка соединения
+        Команда - проверка соединения и согласование параметров передачи
+        :param connection: соединение с клиентом
+        :param args: список строк вида 'параметр=значение'.
+        Параметр mode - режим передачи: 'text' или 'binary'.
+        Параметр checksum - алгоритм контрольной суммы из CheckSum.algorithms. В текстовом режиме доступны только
+        алгоритмы из CheckSum.textAlgorithms.
+        Параметр compress - алгоритм сжатия ответов из compression.codecs или 'none'. Доступен только в двоичном режиме.
+        Новые параметры начинают действовать после отправки ответа на команду
+        :return: кортеж из пар: код ответа, сообщение
         """
-        return (200, 'Hello'),
+        try:
+            options = dict(arg.split('=', 1) for arg in args)
+        except ValueError:
+            return (102, ''),
+        if set(options) - {'mode', 'checksum', 'compress'}:
+            return (102, ''),
+        if 'mode' in options and options['mode'] not in photoAlbumServer.transferModes:
+            return (102, ''),
+        if 'checksum' in options and options['checksum'] not in CheckSum.algorithms:
+            return (102, ''),
+        binaryMode = options.get('mode', 'binary' if connection.binaryMode else 'text') == 'binary'
+        if not binaryMode and ('mode' in options or 'checksum' in options):
+            # Алгоритм, который будет действовать после команды: новый или текущий при возврате в текстовый режим
+            checkSum = CheckSum.algorithms[options['checksum']] if 'checksum' in options else connection.checkSum
+            if any(checkSum is CheckSum.algorithms[name] for name in CheckSum.algorithms
+                   if name not in CheckSum.textAlgorithms):
+                return (102, ''),
+        if 'compress' in options:
+            if options['compress'] != 'none' and (options['compress'] not in compression.codecs or not binaryMode):
+                return (102, ''),
+        connection.pendingOptions.update(options)
+        return (200, ' '.join(['Hello', *args])),
 
-    def _auth(self, args) -> tuple[tuple[int, str]]:
+    def _auth(self, connection: Connection, args) -> tuple[tuple[int, str]]:
         """
         Команда - аутентификация клиента по логину и паролю
+        :param connection: соединение с клиентом
         :param args: список содержащий два аргумента - логин и пароль
         :return: кортеж из пар: код ответа, сообщение
         """
@@ -223,67 +743,78 @@ class photoAlbumServer:
 
         # Проверка существования логина и верности пароля, введённых клиентом
         user, password = args
-        flagSuccess = False
-        with open("users.txt", "r") as usersFile:
-            for line in usersFile.read().split('\n'):
-                dataUser = line.split()
-                if user == dataUser[0] and password == dataUser[1]:
-                    flagSuccess = True
-                    break
+        if self.credentials.isLocked(user):
+            # Слишком много неверных попыток подряд - вход временно заблокирован
+            return (106, ''),
 
-        if flagSuccess:
+        if self.credentials.verify(user, password):
             # Если проверка логина и пароля прошла, создаётся сессия для текущего клиента
-            self.currentSession = Session(user)
+            connection.session = Session(user, self.directoryStart)
             return (200, ''),
         else:
             # Иначе, отправляется сообщение об ошибке авторизации
             return (101, ''),
 
-    def _pwd(self, args) -> tuple[tuple[int, Any]]:
+    def _pwd(self, connection: Connection, args) -> tuple[tuple[int, Any]]:
         """
         Команда - вывод текущей директории клиента
+        :param connection: соединение с клиентом
         :return: кортеж из пар: код ответа, сообщение
         """
-        return (200, self.currentSession.directoryCurrent),
+        return (200, connection.session.directoryCurrent),
 
-    def _ls(self, args: list):
+    def _ls(self, connection: Connection, args: list):
         """
         Команда - просмотр содержимого каталога
-        :param args: список содержащий 0 или 1 строку - путь к каталогу относительно текущего
-        Если в args нет строки, просматривается текущий каталог клиента. Иначе - просмотр каталога по переданному пути
+        :param connection: соединение с клиентом
+        :param args: список содержащий 0 или 1 строку - путь к каталогу относительно текущего,
+        и параметры вида 'параметр=значение':
+        page - номер страницы, начиная с 1; size - количество элементов на странице;
+        ext - расширение файлов, которые нужно показать (каталоги при этом не показываются);
+        prefix - начало имени показываемых элементов.
+        Если в args нет пути, просматривается текущий каталог клиента. Иначе - просмотр каталога по переданному пути
         :return: кортеж из пар: код ответа, сообщение
         """
-        if len(args) > 1:
+        paths = [arg for arg in args if '=' not in arg]
+        try:
+            options = dict(arg.split('=', 1) for arg in args if '=' in arg)
+            page = int(options.pop('page', 1))
+            pageSize = int(options.pop('size', 0))
+        except ValueError:
+            return (102, ''),
+        extension = options.pop('ext', None)
+        prefix = options.pop('prefix', '')
+        if len(paths) > 1 or options or page < 1 or pageSize < 0:
             return (102, ''),
         # Формирование относительного пути просматриваемого каталога
-        path = self.currentSession.directoryCurrent
-        if len(args) == 1:
-            path += fr'\{args[0]}'
+        path = connection.session.directoryCurrent
+        if len(paths) == 1:
+            path = os.path.join(path, paths[0])
 
-        # Проверка существования каталога
-        if os.path.exists(path) and os.path.isdir(path):
-            # Просмотр содержимого каталога
-            listContentDir = []
-            for item in os.listdir(path):
-                fullPathToItem = os.path.join(path, item)
-                if os.path.isdir(fullPathToItem):
-                    # Если элемент каталога - каталог, добавляется пометка 'd-'
-                    listContentDir.append(f'd-{item}')
-                else:
-                    if any(map(item.lower().endswith, self.fileExtensions)):
-                        # Если элемент каталога - поддерживаемый файл, добавляется пометка 'f-'
-                        listContentDir.append(f'f-{item}')
-            # Формирование строки со списком каталога
-            listOfDir = ' '.join(listContentDir)
-            # Возвращаются два ответа: 1 - успешность выполнения, размер списка каталога,
+        # Содержимое каталога из индекса: каталоги с пометкой 'd-', поддерживаемые файлы с пометкой 'f-'
+        listing = self.directoryIndex.listing(path)
+        if listing is not None:
+            markers = listing.markers
+            if extension is not None or prefix:
+                markers = [marker for marker in markers
+                           if marker[2:].startswith(prefix) and
+                           (extension is None or
+                            marker[0] == 'f' and marker.lower().endswith(f'.{extension.lower()}'))]
+            total = len(markers)
+            if pageSize:
+                markers = markers[(page - 1) * pageSize:page * pageSize]
+            # Строка со списком каталога, без фильтров и страниц - уже готовая в индексе
+            listOfDir = listing.text if markers is listing.markers else ' '.join(markers)
+            # Возвращаются два ответа: 1 - успешность выполнения, размер списка каталога и количество элементов,
             # 2 - команда 0, строка со списком каталога
-            return (200, f'{len(listOfDir)} bytes'), (0, listOfDir)
+            return (200, f'{len(listOfDir)} bytes - {total} items'), (0, listOfDir)
         else:
             return (149, ''),
 
-    def _cd(self, args):
+    def _cd(self, connection: Connection, args):
         """
         Команда - переход в каталог по указанному пути
+        :param connection: соединение с клиентом
         :param args: список содержащий 1 строку - путь к каталогу, относительно текущего
         :return: кортеж из пар: код ответа, сообщение
         """
@@ -292,68 +823,418 @@ class photoAlbumServer:
 
         if args[0] == '~':
             # Переход к стартовой директории
-            self.currentSession.directoryCurrent = Session.directoryStart
+            connection.session.directoryCurrent = self.directoryStart
             return (200, ''),
 
         # Проверка существования указанного пути относительно текущего
-        if os.path.exists(self.currentSession.directoryCurrent + '/' + args[0]):
-            self.currentSession.directoryCurrent = os.path.relpath(self.currentSession.directoryCurrent + '/' + args[0])
+        if self.directoryIndex.isDirectory(connection.session.directoryCurrent + '/' + args[0]):
+            connection.session.directoryCurrent = os.path.relpath(connection.session.directoryCurrent + '/' + args[0])
             return (200, ''),
         else:
             return (149, ''),
 
-    def _get(self, args):
+    def _get(self, connection: Connection, args):
         """
         Команда - получение файла из текущего каталога
-        :param args: список содержащий 1 строку - название файла в текущем каталоге
+        :param connection: соединение с клиентом
+        :param args: список содержащий 1 строку - название файла в текущем каталоге,
+        или 3 строки - название файла, смещение и длина запрашиваемого диапазона байт файла
         :return: кортеж из пар: код ответа, сообщение
         """
-        if len(args) != 1:
+        if len(args) not in (1, 3):
             return (102, ''),
-        pathToFile = self.currentSession.directoryCurrent + '/' + args[0]
+        pathToFile = connection.session.directoryCurrent + '/' + args[0]
 
-        # Проверка существования пути к файлу и является ли файл по указанному пути файлов
-        if os.path.exists(pathToFile) and os.path.isfile(pathToFile):
-            # Проверка поддерживаемости файла
-            if pathToFile.split('.')[-1] in self.fileExtensions:
-                # Кодировка файла
-                resultEncoding, msg = self._encodePhoto(pathToFile)
-                if resultEncoding:
-                    # Если кодировка прошла успешно
-                    return (200, f'File follows - {len(msg)} bytes'), (0, msg.decode())
-                else:
-                    return (104, ''),
+        # Проверка файла на существование и поддерживаемость
+        resultCheck = self._checkPhoto(pathToFile)
+        if resultCheck:
+            return resultCheck
+
+        if len(args) == 3:
+            # Передача диапазона байт файла
+            try:
+                offset, length = int(args[1]), int(args[2])
+            except ValueError:
+                return (102, ''),
+            return self._streamPhoto(connection, pathToFile, offset, length)
+        # Передача файла целиком, по частям или одним сообщением
+        return self._streamPhoto(connection, pathToFile)
+
+    def _mget(self, connection: Connection, args):
+        """
+        Команда - получение нескольких файлов из текущего каталога одним запросом
+        :param connection: соединение с клиентом
+        :param args: список строк - названия файлов или шаблоны вида '*.jpg' в текущем каталоге
+        :return: итератор из пар: код ответа, сообщение.
+        Первая пара - количество файлов, далее для каждого файла - заголовок с именем, размером и контрольной суммой
+        и части файла с кодом 0, последняя пара - итог с именами и кодами ошибок файлов, которые не были отправлены
+        """
+        if not args:
+            return (102, ''),
+        names, failed = [], []
+        for arg in args:
+            if any(symbol in arg for symbol in '*?['):
+                # Шаблон раскрывается по поддерживаемым файлам текущего каталога
+                listing = self.directoryIndex.listing(connection.session.directoryCurrent)
+                matches = fnmatch.filter(listing.photos, arg) if listing is not None else []
+                if not matches:
+                    failed.append(f'{arg}:149')
+                names.extend(matches)
             else:
-                return (103, ''),
-        else:
+                names.append(arg)
+        # Повторяющиеся имена отправляются один раз
+        names = list(dict.fromkeys(names))
+
+        files = []
+        for name in names:
+            pathToFile = connection.session.directoryCurrent + '/' + name
+            # Та же проверка существования и поддерживаемости, что и в команде get
+            resultCheck = self._checkPhoto(pathToFile)
+            if resultCheck:
+                failed.append(f'{name}:{resultCheck[0][0]}')
+            else:
+                files.append((name, pathToFile))
+        return itertools.chain(((200, f'{len(files)} files follow'),), self._streamPhotos(connection, files, failed))
+
+    def _streamPhotos(self, connection: Connection, files: list, failed: list):
+        """
+        Генератор ответа на команду mget: файлы передаются друг за другом, каждый со своим заголовком
+        :param connection: соединение с клиентом
+        :param files: список пар (имя файла, путь к файлу)
+        :param failed: список строк 'ИМЯ:КОД' - файлы, не прошедшие проверку. Дополняется файлами,
+        которые не удалось прочитать
+        :return: пары: код ответа, сообщение
+        """
+        encoder = self._payloadEncoder(connection)
+        sent = 0
+        for name, path in files:
+            try:
+                with open(path, 'rb') as imageFile:
+                    data = photoAlbumServer._readPhoto(imageFile)
+            except (OSError, ValueError):
+                logger.warning('Could not open file %s', path)
+                failed.append(f'{name}:104')
+                continue
+            length = len(data)
+            chunkSize = self.chunkSize or max(length, 1)
+            countParts = max(1, -(-length // chunkSize))
+            encodedSize = length if connection.binaryMode else 4 * ((length + 2) // 3)
+            # Контрольная сумма исходного файла, вычисленная алгоритмом соединения
+            fileSum = photoAlbumServer._checkSumOf(connection, data)
+            yield 200, f'File {name} - {encodedSize} bytes - {countParts} parts - checksum {fileSum:08X}'
+            yield from photoAlbumServer._encodeBufferChunks(data, chunkSize, encoder)
+            del data
+            sent += 1
+        yield 200, f'Done - {sent} sent - {len(failed)} failed' + (': ' + ' '.join(failed) if failed else '')
+
+    def _parts(self, connection: Connection, args):
+        """
+        Команда - повторное получение отдельных частей файла из текущего каталога
+        :param connection: соединение с клиентом
+        :param args: список строк - название файла и номера частей (начиная с 0).
+        Размер части равен chunkSize, если потоковая передача отключена - файл состоит из одной части
+        :return: кортеж из пар: код ответа, сообщение
+        """
+        if len(args) < 2:
+            return (102, ''),
+        pathToFile = connection.session.directoryCurrent + '/' + args[0]
+
+        resultCheck = self._checkPhoto(pathToFile)
+        if resultCheck:
+            return resultCheck
+        try:
+            indices = [int(index) for index in args[1:]]
+        except ValueError:
+            return (102, ''),
+
+        try:
+            fileStat = os.stat(pathToFile)
+        except OSError:
+            logger.warning('Could not open file %s', pathToFile)
+            return (104, ''),
+        size = fileStat.st_size
+        partSize = self.chunkSize or size
+        countParts = max(1, -(-size // partSize)) if partSize else 1
+        if not all(0 <= index < countParts for index in indices):
+            return (105, ''),
+        header = (200, f'{len(indices)} parts follow'),
+
+        # Части файла, сохранённого в кэше, отправляются без чтения с диска
+        cachedParts = self.photoCache.get(self._cacheKey(connection, pathToFile, fileStat))
+        if cachedParts is not None:
+            return itertools.chain(header, (cachedParts[index] for index in indices))
+
+        try:
+            imageFile = open(pathToFile, "rb")
+        except OSError:
+            logger.warning('Could not open file %s', pathToFile)
+            return (104, ''),
+        return itertools.chain(header,
+                               photoAlbumServer._encodePhotoParts(imageFile, partSize, indices,
+                                                                  self._payloadEncoder(connection)))
+
+    def _thumb(self, connection: Connection, args):
+        """
+        Команда - получение уменьшенной копии фото из текущего каталога
+        :param connection: соединение с клиентом
+        :param args: список содержащий 1 строку - название файла в текущем каталоге,
+        и необязательно вторую строку - размер большей стороны копии в пикселях
+        :return: кортеж из пар: код ответа, сообщение. Копия в формате JPEG передаётся так же, как файл командой get
+        """
+        if len(args) not in (1, 2):
+            return (102, ''),
+        side = None
+        if len(args) == 2:
+            try:
+                side = int(args[1])
+            except ValueError:
+                return (102, ''),
+            if not 0 < side <= photoAlbumServer.maxThumbnailSide:
+                return (102, ''),
+        pathToFile = connection.session.directoryCurrent + '/' + args[0]
+
+        resultCheck = self._checkPhoto(pathToFile)
+        if resultCheck:
+            return resultCheck
+        thumbnailPath = self.thumbnailCache.thumbnail(pathToFile, side)
+        if thumbnailPath is None:
+            return (104, ''),
+        return self._streamPhoto(connection, thumbnailPath)
+
+    def _checkPhoto(self, pathToFile: str):
+        """
+        Проверка существования и поддерживаемости файла, запрашиваемого клиентом
+        :param pathToFile: строка - путь к файлу
+        :return: None, если файл можно отправить, иначе - кортеж из пары с кодом ошибки
+        """
+        # Проверка существования пути к файлу и является ли файл по указанному пути файлов
+        if not self.directoryIndex.isFile(pathToFile):
             return (149, ''),
+        # Проверка поддерживаемости файла
+        if not self.directoryIndex.isSupported(pathToFile):
+            return (103, ''),
+        return None
 
-    @staticmethod
-    def _encodePhoto(path: str) -> tuple[bool, bytes]:
+    def _streamPhoto(self, connection: Connection, path: str, offset: int = 0, length: int = None):
         """
-        Кодирование фото в байты по протоколу base64
+        Формирование ответа на команду get для потоковой передачи файла или его диапазона.
+        Файл, запрошенный целиком, берётся из кэша или сохраняется в кэш после отправки
+        :param connection: соединение с клиентом
         :param path: строка - путь к фото
-        :return: кортеж:
-                    1. (bool=True, bytes) - если файл был открыт и зашифрован, bytes - зашифрованный файл
-                    2. (bool=False, bytes=b'') - если произошла ошибка при открытии или шифровании файла
+        :param offset: смещение начала передаваемого диапазона от начала файла в байтах
+        :param length: длина диапазона в байтах. Если не задана - передаётся файл до конца.
+        Диапазон, выходящий за конец файла, обрезается
+        :return: итератор из пар: код ответа, сообщение.
+        Первая пара - заголовок с размером закодированного диапазона и количеством частей,
+        далее - части файла с кодом 0
         """
-        flagOpened = True
-        encodedImage = b''
+        try:
+            fileStat = os.stat(path)
+        except OSError:
+            logger.warning('Could not open file %s', path)
+            return (104, ''),
+        size = fileStat.st_size
+        if offset < 0 or offset > size or (length is not None and length <= 0):
+            return (105, ''),
+        length = size - offset if length is None else min(length, size - offset)
+
+        # Если потоковая передача отключена, диапазон передаётся одной частью
+        chunkSize = self.chunkSize or max(length, 1)
+        countParts = max(1, -(-length // chunkSize))
+        # Размер диапазона после кодирования
+        encodedSize = length if connection.binaryMode else 4 * ((length + 2) // 3)
+        header = (200, f'File follows - {encodedSize} bytes - {countParts} parts'),
+
+        # Кэшируются только файлы, запрошенные целиком
+        cacheKey = self._cacheKey(connection, path, fileStat) if length == size else None
+        if cacheKey is not None:
+            cachedParts = self.photoCache.get(cacheKey)
+            if cachedParts is not None:
+                return itertools.chain(header, cachedParts)
+
         try:
             imageFile = open(path, "rb")
-            encodedImage = base64.b64encode(imageFile.read())
         except OSError:
-            print(f"Could not open file {path}")
-            flagOpened = False
-        return flagOpened, encodedImage
+            logger.warning('Could not open file %s', path)
+            return (104, ''),
+        imageFile.seek(offset)
+        parts = photoAlbumServer._encodePhotoChunks(imageFile, chunkSize, length, self._payloadEncoder(connection))
+        if cacheKey is not None and encodedSize <= self.photoCache.maxBytes:
+            parts = self._cacheParts(connection, cacheKey, parts)
+        return itertools.chain(header, parts)
+
+    def _cacheKey(self, connection: Connection, path: str, fileStat: os.stat_result) -> tuple:
+        """
+        Ключ кэша закодированного фото. Изменённый файл получает новый ключ, поэтому устаревшие части не отправляются
+        :param connection: соединение с клиентом
+        :param path: строка - путь к фото
+        :param fileStat: результат os.stat для фото
+        :return: кортеж - путь, размер и время изменения файла, а также параметры кодирования частей
+        """
+        return (os.path.abspath(path), fileStat.st_size, fileStat.st_mtime_ns,
+                self.chunkSize, connection.binaryMode, connection.checkSum)
+
+    def _cacheParts(self, connection: Connection, cacheKey: tuple, parts):
+        """
+        Генератор, передающий части файла дальше и сохраняющий их в кэш после последней части.
+        Часть передаётся списком: responseFrames записывает в него сообщение внутри собранного кадра
+        и контрольную сумму, вычисленную при сборке, поэтому часть не копируется и не проверяется отдельно
+        :param connection: соединение с клиентом
+        :param cacheKey: ключ кэша
+        :param parts: итератор пар (0, bytes или memoryview) - закодированные части файла
+        :return: списки [0, сообщение, None]
+        """
+        cachedParts = []
+        for code, message in parts:
+            part = [code, message, None]
+            yield part
+            # Кадр уже собран. Если сообщение не взято из кадра (кадр с меткой или сжатый), срез отображённого
+            # в память файла копируется: кэш не должен держать отображение открытым
+            if part[1] is message and isinstance(message, memoryview):
+                part[1] = message.tobytes()
+            cachedParts.append(tuple(part))
+        self.photoCache.put(cacheKey, tuple(cachedParts))
+
+    def _payloadEncoder(self, connection: Connection):
+        """
+        Выбор кодирования частей файла в зависимости от режима передачи.
+        Время кодирования и количество прочитанных байт файла учитываются в метриках
+        :param connection: соединение с клиентом
+        :return: функция, принимающая блок байт файла и возвращающая содержимое сообщения:
+        в текстовом режиме - кодирование base64, в двоичном - блок без изменений и без копирования
+        """
+        encoder = (lambda block: block) if connection.binaryMode else base64.b64encode
+        mode = 'binary' if connection.binaryMode else 'text'
+
+        def encode(block):
+            with self.metrics.timer('encode_seconds', mode=mode):
+                payload = encoder(block)
+            self.metrics.increment('file_bytes_read_total', len(block))
+            return payload
+        return encode
+
+    @staticmethod
+    def _mapPhoto(imageFile, offset: int = 0, length: int = 0) -> memoryview:
+        """
+        Отображение файла или его участка в память только для чтения.
+        Отображение держит собственный дескриптор, поэтому файл можно закрыть сразу.
+        Отображение освобождается, когда удалён последний срез
+        :param imageFile: открытый в режиме "rb" непустой файл
+        :param offset: начало участка в байтах
+        :param length: длина участка в байтах, 0 - до конца файла
+        :return: memoryview участка файла
+        """
+        # Начало отображения должно быть кратно гранулярности выделения памяти
+        mapOffset = offset - offset % mmap.ALLOCATIONGRANULARITY
+        mapping = mmap.mmap(imageFile.fileno(), length and length + offset - mapOffset,
+                            access=mmap.ACCESS_READ, offset=mapOffset)
+        return memoryview(mapping)[offset - mapOffset:]
+
+    @staticmethod
+    def _readPhoto(imageFile):
+        """
+        Чтение файла целиком: большой файл отображается в память, маленький - читается
+        :param imageFile: открытый в режиме "rb" файл
+        :return: memoryview отображения или bytes
+        """
+        if os.fstat(imageFile.fileno()).st_size >= photoAlbumServer.mmapThreshold:
+            return photoAlbumServer._mapPhoto(imageFile)
+        return imageFile.read()
+
+    @staticmethod
+    def _encodeBufferChunks(buffer, chunkSize: int, encoder=base64.b64encode):
+        """
+        Генератор частей данных, уже находящихся в памяти. Кодировщик получает срезы без копирования
+        :param buffer: bytes или memoryview
+        :param chunkSize: размер части в байтах, кратный 3
+        :param encoder: функция кодирования части, по умолчанию - base64
+        :return: пары (0, закодированная часть)
+        """
+        # Пустые данные передаются одной пустой частью
+        yield 0, encoder(buffer[:chunkSize])
+        for position in range(chunkSize, len(buffer), chunkSize):
+            yield 0, encoder(buffer[position:position + chunkSize])
+
+    @staticmethod
+    def _encodePhotoChunks(imageFile, chunkSize: int, length: int = None, encoder=base64.b64encode):
+        """
+        Генератор частей фото, закодированных по протоколу base64.
+        Маленький файл читается блоками фиксированного размера, поэтому в памяти находится только текущий блок.
+        Файл от mmapThreshold байт отображается в память окнами по mmapWindow байт, и кодировщик получает
+        срезы отображения без промежуточных копий
+        :param imageFile: открытый в режиме "rb" файл, закрывается по окончании чтения.
+        Чтение начинается с текущей позиции файла
+        :param chunkSize: размер блока в байтах, кратный 3
+        :param length: количество байт, которое нужно прочитать. Если не задано - файл читается до конца
+        :param encoder: функция кодирования блока, по умолчанию - base64
+        :return: пары (0, закодированная часть) - закодированные части файла
+        """
+        with imageFile:
+            start = imageFile.tell()
+            end = os.fstat(imageFile.fileno()).st_size
+            if length is not None:
+                end = min(end, start + length)
+            if end - start < photoAlbumServer.mmapThreshold:
+                left = length
+                block = imageFile.read(chunkSize if left is None else min(chunkSize, left))
+                # Пустой файл передаётся одной пустой частью
+                yield 0, encoder(block)
+                while left is None or (left := left - len(block)) > 0:
+                    block = imageFile.read(chunkSize if left is None else min(chunkSize, left))
+                    if not block:
+                        break
+                    yield 0, encoder(block)
+                return
+            # Окно содержит целое число частей, поэтому части не пересекают границы окон
+            step = max(1, photoAlbumServer.mmapWindow // chunkSize) * chunkSize
+            for windowStart in range(start, end, step):
+                window = photoAlbumServer._mapPhoto(imageFile, windowStart, min(step, end - windowStart))
+                yield from photoAlbumServer._encodeBufferChunks(window, chunkSize, encoder)
+                del window
+
+    @staticmethod
+    def _encodePhotoParts(imageFile, partSize: int, indices: list, encoder=base64.b64encode):
+        """
+        Генератор выбранных частей фото, закодированных по протоколу base64
+        :param imageFile: открытый в режиме "rb" файл, закрывается по окончании чтения
+        :param partSize: размер части в байтах
+        :param indices: список номеров частей в порядке отправки
+        :param encoder: функция кодирования части, по умолчанию - base64
+        :return: пары (0, bytes) - закодированные части файла
+        """
+        with imageFile:
+            for index in indices:
+                imageFile.seek(index * partSize)
+                yield 0, encoder(imageFile.read(partSize))
+
+    @staticmethod
+    def _resend(connection: Connection, args):
+        """
+        Команда - повторная отправка кадров ответа на запрос с номером
+        :param connection: соединение с клиентом
+        :param args: список строк - номер запроса и номера кадров ответа на него (начиная с 0)
+        :return: кортеж из кадров в том виде, в котором они были отправлены,
+        или пара с кодом ошибки, если кадра уже нет в буфере
+        """
+        if len(args) < 2:
+            return (102, ''),
+        try:
+            sequence, *indices = [int(arg) for arg in args]
+        except ValueError:
+            return (102, ''),
+        frames = tuple(connection.sentFrame(sequence, index) for index in indices)
+        if None in frames:
+            return (107, ''),
+        return frames
 
-    def _quit(self, args):
+    def _quit(self, connection: Connection, args):
         """
         Команда - завершение сессии
+        :param connection: соединение с клиентом
         :param args: пустой список
         :return: кортеж из пар: код ответа, сообщение
         """
         #if len(args):
         #    return 102, ''
-        self.currentSession = None
+        connection.session = None
         return (200, 'Goodbye!'),
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+
+class PhotoCache:
+    """
+    Кэш закодированных фото с вытеснением давно не использованных записей (LRU).
+    Запись - кортеж частей файла, готовых к отправке: (0, закодированная часть, контрольная сумма сообщения).
+    Контрольная сумма - None, если при первой отправке кадр был с меткой или сжат
+    """
+
+    def __init__(self, maxBytes: int):
+        """
+        Инициализация кэша
+        :param maxBytes: максимальный суммарный размер закодированных частей в байтах. 0 - кэш отключён
+        """
+        if maxBytes < 0:
+            raise ValueError('Cache size must not be negative')
+        self.maxBytes = maxBytes
+        self.currentBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entrySize(parts) -> int:
+        """
+        Размер записи кэша
+        :param parts: части файла
+        :return: суммарный размер закодированных частей в байтах
+        """
+        return sum(len(part[1]) for part in parts)
+
+    def get(self, key):
+        """
+        Получение записи из кэша. Найденная запись становится самой новой
+        :param key: ключ записи
+        :return: кортеж частей файла или None, если записи нет в кэше
+        """
+        with self._lock:
+            parts = self._entries.get(key)
+            if parts is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return parts
+
+    def put(self, key, parts: tuple):
+        """
+        Добавление записи в кэш. Если размер кэша превышен, вытесняются самые старые записи
+        :param key: ключ записи
+        :param parts: кортеж частей файла
+        """
+        size = PhotoCache.entrySize(parts)
+        if size > self.maxBytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.currentBytes -= PhotoCache.entrySize(self._entries.pop(key))
+            self._entries[key] = parts
+            self.currentBytes += size
+            while self.currentBytes > self.maxBytes:
+                _, oldParts = self._entries.popitem(last=False)
+                self.currentBytes -= PhotoCache.entrySize(oldParts)
+
+    def stats(self) -> dict:
+        """
+        Статистика использования кэша
+        :return: словарь с количеством попаданий, промахов, записей и занятым объёмом в байтах
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.currentBytes
+            }
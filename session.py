@@ -1,6 +1,5 @@
 class Session:
-    directoryStart = ''
-
-    def __init__(self, user=None):
-        self.directoryCurrent = Session.directoryStart
+    def __init__(self, user=None, directoryStart=''):
+        self.directoryStart = directoryStart
+        self.directoryCurrent = directoryStart
         self.user = user
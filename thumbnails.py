@@ -0,0 +1,113 @@
+import os
+import glob
+import hashlib
+import logging
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    # Без Pillow сервер работает, но команда thumb возвращает ошибку
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailCache:
+    """
+    Дисковый кэш уменьшенных копий фото.
+    Имя файла копии строится из пути к исходному фото, размера стороны и времени изменения фото,
+    поэтому после изменения фото копия создаётся заново
+    """
+
+    def __init__(self, cacheDirectory: str, defaultSide: int = 128):
+        """
+        :param cacheDirectory: путь к каталогу кэша, создаётся при первой записи
+        :param defaultSide: размер большей стороны копии по умолчанию в пикселях
+        """
+        self.cacheDirectory = cacheDirectory
+        self.defaultSide = defaultSide
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def isAvailable() -> bool:
+        """
+        Проверка возможности создавать копии
+        :return: True, если установлена библиотека Pillow
+        """
+        return Image is not None
+
+    def _thumbnailPath(self, path: str, side: int, mtime: int) -> str:
+        """
+        Путь к файлу копии в кэше
+        :param path: путь к исходному фото
+        :param side: размер большей стороны копии
+        :param mtime: время изменения исходного фото в наносекундах
+        :return: строка - путь к файлу копии
+        """
+        name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+        return os.path.join(self.cacheDirectory, f'{name}_{side}_{mtime}.jpg')
+
+    def thumbnail(self, path: str, side: int = None):
+        """
+        Получение уменьшенной копии фото. Если копии нет в кэше или фото изменилось, копия создаётся
+        :param path: путь к исходному фото
+        :param side: размер большей стороны копии в пикселях, по умолчанию - defaultSide
+        :return: строка - путь к файлу копии в формате JPEG, или None, если копию создать не удалось
+        """
+        if Image is None:
+            return None
+        side = side or self.defaultSide
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        thumbnailPath = self._thumbnailPath(path, side, mtime)
+        if os.path.exists(thumbnailPath):
+            return thumbnailPath
+
+        try:
+            with Image.open(path) as image:
+                image.thumbnail((side, side))
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+                with self._lock:
+                    os.makedirs(self.cacheDirectory, exist_ok=True)
+                    # Копии для прежних версий фото больше не нужны
+                    for oldPath in glob.glob(thumbnailPath.rsplit('_', 1)[0] + '_*.jpg'):
+                        os.remove(oldPath)
+                    # Запись через временный файл, чтобы не отдать клиенту недописанную копию
+                    temporaryPath = thumbnailPath + '.tmp'
+                    image.save(temporaryPath, 'JPEG')
+                    os.replace(temporaryPath, thumbnailPath)
+        except OSError:
+            logger.warning('Could not make thumbnail of %s', path)
+            return None
+        return thumbnailPath
+
+    def pregenerate(self, root: str, isSupported, side: int = None) -> int:
+        """
+        Создание копий для всех поддерживаемых фото в дереве каталогов
+        :param root: путь к корневому каталогу
+        :param isSupported: функция, принимающая имя файла и возвращающая True, если файл поддерживается
+        :param side: размер большей стороны копий, по умолчанию - defaultSide
+        :return: количество фото, для которых есть копия
+        """
+        count = 0
+        for directory, _, files in os.walk(root):
+            for name in files:
+                if isSupported(name) and self.thumbnail(os.path.join(directory, name), side) is not None:
+                    count += 1
+        return count
+
+    def startPregeneration(self, root: str, isSupported, side: int = None) -> threading.Thread:
+        """
+        Запуск создания копий в фоновом потоке
+        :param root: путь к корневому каталогу
+        :param isSupported: функция, принимающая имя файла и возвращающая True, если файл поддерживается
+        :param side: размер большей стороны копий, по умолчанию - defaultSide
+        :return: запущенный поток
+        """
+        thread = threading.Thread(target=self.pregenerate, args=(root, isSupported, side), daemon=True)
+        thread.start()
+        return thread